@@ -0,0 +1,118 @@
+import re
+from shared.models import ContactDTO, ContactType, Message
+
+# Job boards whose links are stored as EXTERNAL_PLATFORM contacts
+EXTERNAL_PLATFORM_DOMAINS = (
+  "hh.ru",
+  "hh.kz",
+  "headhunter.ru",
+  "linkedin.com",
+  "career.habr.com",
+  "djinni.co",
+  "getmatch.ru",
+  "superjob.ru",
+  "indeed.com",
+  "glassdoor.com",
+)
+
+_EMAIL = re.compile(
+  r"(?<![\w.+-])[\w.+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}"
+)
+# "+<country code> ..." with 10-15 digits, or a Russian "8 (999) 123-45-67".
+# Separators between digits are limited, so salary ranges do not match
+_PHONE = re.compile(
+  r"(?<![\w+])(?:\+\d(?:[\s().-]{0,2}\d){9,14}"
+  r"|8[\s(-]{0,2}\d{3}[\s)-]{0,2}\d{3}[\s-]?\d{2}[\s-]?\d{2})(?!\d)"
+)
+_USERNAME = re.compile(r"(?<![\w@.])@([A-Za-z][A-Za-z0-9_]{3,31})(?![\w@.])")
+# t.me/<username>, but not post links (t.me/channel/123) or invites (t.me/+...)
+_TELEGRAM_LINK = re.compile(
+  r"(?<![\w.])(?:https?://)?(?:t|telegram)\.me/([A-Za-z][A-Za-z0-9_]{3,31})(?![\w/])"
+)
+_PLATFORM_LINK = re.compile(
+  r"(?<![\w.])(?:https?://)?(?:[\w-]+\.)*(?:"
+  + "|".join(re.escape(domain) for domain in EXTERNAL_PLATFORM_DOMAINS)
+  + r")(?:/[^\s<>()\[\]\"']*)?",
+  re.IGNORECASE,
+)
+
+
+def extract_contacts(text: str | None) -> list[ContactDTO]:
+  """Phones, emails, Telegram usernames and job board links found in a text.
+
+  Values are normalized (phones to "+digits", usernames to "@name") and
+  listed once each, in order of appearance.
+  """
+  if not text:
+    return []
+  found: list[tuple[int, ContactType, str]] = []
+  for match in _EMAIL.finditer(text):
+    found.append((match.start(), ContactType.EMAIL, match.group().lower()))
+  for match in _PHONE.finditer(text):
+    found.append((match.start(), ContactType.PHONE, _normalize_phone(match.group())))
+  for pattern in (_USERNAME, _TELEGRAM_LINK):
+    for match in pattern.finditer(text):
+      found.append((match.start(), ContactType.TELEGRAM_USERNAME, f"@{match[1]}"))
+  for match in _PLATFORM_LINK.finditer(text):
+    found.append(
+      (match.start(), ContactType.EXTERNAL_PLATFORM, match.group().rstrip(".,;:!?"))
+    )
+
+  contacts: list[ContactDTO] = []
+  seen: set[tuple[ContactType, str]] = set()
+  for _, contact_type, value in sorted(found, key=lambda item: item[0]):
+    key = (contact_type, value.lower())
+    if key not in seen:
+      seen.add(key)
+      contacts.append(ContactDTO(type=contact_type, value=value))
+  return contacts
+
+
+def merge_contacts(
+  local: list[ContactDTO], extracted: list[ContactDTO]
+) -> list[ContactDTO]:
+  """Local contacts followed by the model's ones that are not among them."""
+  seen = {(c.type, _contact_key(c)) for c in local}
+  return local + [c for c in extracted if (c.type, _contact_key(c)) not in seen]
+
+
+def duplicate_contacts(
+  contacts: list[ContactDTO], source: Message, duplicate: Message
+) -> list[ContactDTO]:
+  """Contacts for a near-duplicate of `source`, whose review has `contacts`.
+
+  Near-duplicates may differ exactly in their contact lines or sender, so
+  nothing is copied: the duplicate gets the contacts found in its own text,
+  plus its own sender if the review pointed at the sender of `source`.
+  """
+  found = extract_contacts(duplicate.text)
+  if duplicate.from_id is not None and _names_sender(contacts, source):
+    found.append(ContactDTO(type=ContactType.TELEGRAM_ID, value=str(duplicate.from_id)))
+  return found
+
+
+def _names_sender(contacts: list[ContactDTO], message: Message) -> bool:
+  """Whether contacts point at the sender of a message: by TELEGRAM_ID or,
+  once resolved, by a username that is not written in its text."""
+  written = {_contact_key(c) for c in extract_contacts(message.text)}
+  for contact in contacts:
+    if contact.type == ContactType.TELEGRAM_ID:
+      if contact.value == str(message.from_id):
+        return True
+    elif contact.type == ContactType.TELEGRAM_USERNAME:
+      if _contact_key(contact) not in written:
+        return True
+  return False
+
+
+def _normalize_phone(value: str) -> str:
+  digits = re.sub(r"\D", "", value)
+  if value.startswith("8") and len(digits) == 11:
+    digits = "7" + digits[1:]
+  return f"+{digits}"
+
+
+def _contact_key(contact: ContactDTO) -> str:
+  if contact.type == ContactType.PHONE:
+    return _normalize_phone(contact.value.strip())
+  return contact.value.strip().lower().removeprefix("@")
@@ -1,11 +1,44 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, exists, func, literal, or_, true, update
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import joinedload
 from sqlmodel import Session, select
 from shared.models import (
+  ContactDTO,
   Message,
+  ReviewQueueItem,
   VacancyReview,
   VacancyProgress,
   VacancyReviewDecision,
   Dialog,
+  utc_now,
+)
+from shared.text import SIMHASH_BANDS, SIMHASH_MAX_DISTANCE, hamming_distance
+from .contacts import duplicate_contacts
+
+# Near-duplicates pulled in on top of a batch of review candidates
+MAX_CLUSTER_MEMBERS = 200
+# Distinct reviewed texts considered as clone sources for one batch
+MAX_CLONE_SOURCES = 1000
+# Reviews per multi-row INSERT, keeps bound parameters below SQLite's limit
+REVIEW_CHUNK_SIZE = 500
+# Queue items that failed this often are left alone for inspection
+MAX_QUEUE_ATTEMPTS = 5
+
+_REVIEW_UPDATE_COLUMNS = (
+  "decision",
+  "contacts",
+  "seniority",
+  "experience",
+  "vacancy_position",
+  "vacancy_description",
+  "vacancy_requirements",
+  "salary_fork_from",
+  "salary_fork_to",
+  "prompt_id",
+  "prompt_version",
+  "reviewed_by",
+  "is_stale",
 )
 
 
@@ -16,15 +49,118 @@ def get_messages_for_review(
   chat_id: int | None = None,
   folder_id: int | None = None,
   unreviewed_only: bool = True,
+  exclude_ids: set[int] | None = None,
+  after_id: int | None = None,
 ) -> list[Message]:
-  """Retrieve messages for review, with optional filtering."""
-  from shared.models import DialogFolderLink
+  """Retrieve messages for review, with optional filtering.
+
+  Messages come in id order, starting after `after_id`, so passing the last
+  returned id pages through all matches (keyset pagination over the primary
+  key). Messages in `exclude_ids` (e.g. ones already being reviewed) are
+  skipped.
+  """
+  statement = _review_statement(
+    account_id, chat_id, folder_id, unreviewed_only, exclude_ids
+  )
+  if after_id is not None:
+    statement = statement.where(Message.id > after_id)
+  statement = statement.order_by(Message.id).limit(limit)  # type: ignore[arg-type]
+  return list(session.exec(statement).all())
+
 
-  statement = select(Message).options(
-    joinedload(Message.dialog).joinedload(Dialog.account)
+def get_messages_by_ids(session: Session, message_ids: list[int]) -> list[Message]:
+  """Messages with their account, in id order."""
+  statement = (
+    select(Message)
+    .options(joinedload(Message.dialog).joinedload(Dialog.account))
+    .where(Message.id.in_(message_ids))  # type: ignore[union-attr]
+    .order_by(Message.id)  # type: ignore[arg-type]
   )
+  return list(session.exec(statement).all())
+
+
+def get_review_clusters(
+  session: Session,
+  limit: int,
+  account_id: int | None = None,
+  chat_id: int | None = None,
+  folder_id: int | None = None,
+  unreviewed_only: bool = True,
+  exclude_ids: set[int] | None = None,
+  after_id: int | None = None,
+) -> tuple[list[list[Message]], int | None]:
+  """Retrieve messages for review grouped into near-duplicate clusters.
+
+  Up to `limit` messages are fetched like `get_messages_for_review`, then
+  near-duplicates matching the same filters are added through the SimHash
+  band index. Like the page itself, they are taken from after `after_id`
+  only. Each cluster starts with its representative, the one message that
+  has to be reviewed; the others can copy its outcome. Also returns the id
+  to pass as `after_id` for the next page.
+  """
+  filters = (account_id, chat_id, folder_id, unreviewed_only, exclude_ids)
+  messages = get_messages_for_review(session, limit, *filters, after_id=after_id)
+  last_id = messages[-1].id if messages else after_id
+  fetched_ids = {m.id for m in messages}
+  near_filter = _near_duplicate_filter(messages)
+  if near_filter is not None:
+    statement = _review_statement(*filters).where(
+      near_filter,
+      Message.id.not_in(fetched_ids),  # type: ignore[union-attr]
+    )
+    if after_id is not None:
+      # Messages before the cursor were handed out on earlier pages already
+      statement = statement.where(Message.id > after_id)
+    statement = statement.order_by(Message.id).limit(MAX_CLUSTER_MEMBERS)  # type: ignore[arg-type]
+    messages += session.exec(statement).all()
+
+  return cluster_messages(messages, seed_ids=fetched_ids), last_id
+
+
+def cluster_messages(
+  messages: list[Message], seed_ids: set[int] | None = None
+) -> list[list[Message]]:
+  """Group messages into near-duplicate clusters, keeping their order.
+
+  The first message of a cluster is its representative. Only messages in
+  `seed_ids` (all by default) may start a cluster, others just join one.
+  """
+  clusters: list[list[Message]] = []
+  for message in messages:
+    cluster = next((c for c in clusters if _is_duplicate(c[0], message)), None)
+    if cluster is not None:
+      cluster.append(message)
+    elif seed_ids is None or message.id in seed_ids:
+      clusters.append([message])
+  return clusters
+
+
+def _review_statement(
+  account_id: int | None,
+  chat_id: int | None,
+  folder_id: int | None,
+  unreviewed_only: bool,
+  exclude_ids: set[int] | None,
+  statement=None,
+):
+  """Filter `statement` (by default messages with their account) for review."""
+  from shared.models import DialogFolderLink
+
+  if statement is None:
+    statement = select(Message).options(
+      joinedload(Message.dialog).joinedload(Dialog.account)
+    )
   if unreviewed_only:
-    statement = statement.where(Message.review == None)  # noqa: E711
+    # Messages edited after their review count as unreviewed again
+    statement = statement.where(
+      or_(
+        Message.review == None,  # noqa: E711
+        Message.review.has(VacancyReview.is_stale),  # type: ignore[attr-defined]
+      )
+    )
+
+  if exclude_ids:
+    statement = statement.where(Message.id.not_in(exclude_ids))  # type: ignore[union-attr]
 
   if account_id is not None or folder_id is not None or chat_id is not None:
     statement = statement.join(Dialog, Message.dialog_id == Dialog.id)
@@ -42,37 +178,466 @@ def get_messages_for_review(
       DialogFolderLink,
       Dialog.id == DialogFolderLink.dialog_id,
     ).where(DialogFolderLink.folder_id == folder_id)
+  return statement
 
-  statement = statement.limit(limit)
-  return list(session.exec(statement).all())
+
+def _band_filter(messages: list[Message]):
+  """Condition matching messages that share a SimHash band with any of these."""
+  bands = [
+    {
+      getattr(m, f"simhash_band_{band}")
+      for m in messages
+      if getattr(m, f"simhash_band_{band}") is not None
+    }
+    for band in range(SIMHASH_BANDS)
+  ]
+  if not any(bands):
+    return None
+  return or_(
+    *(
+      getattr(Message, f"simhash_band_{band}").in_(values)
+      for band, values in enumerate(bands)
+      if values
+    )
+  )
+
+
+def _near_duplicate_filter(messages: list[Message]):
+  """Condition matching near-duplicates of any of these messages.
+
+  The band index narrows the rows down, the Hamming distance check then
+  drops the ones that only share a band by chance, before any LIMIT.
+  """
+  band_filter = _band_filter(messages)
+  if band_filter is None:
+    return None
+  fingerprints = {m.simhash for m in messages if m.simhash is not None}
+  return and_(
+    band_filter,
+    or_(
+      *(
+        func.hamming_distance(Message.simhash, fingerprint) <= SIMHASH_MAX_DISTANCE
+        for fingerprint in fingerprints
+      )
+    ),
+  )
+
+
+def _is_duplicate(a: Message, b: Message) -> bool:
+  if a.text_hash is not None and a.text_hash == b.text_hash:
+    return True
+  return (
+    a.simhash is not None
+    and b.simhash is not None
+    and hamming_distance(a.simhash, b.simhash) <= SIMHASH_MAX_DISTANCE
+  )
 
 
 def save_reviews(session: Session, reviews: list[VacancyReview]) -> None:
-  """Save reviews and create initial progress records for approved ones."""
-  for review in reviews:
-    # Check if review already exists for this message
-    existing_statement = select(VacancyReview).where(
-      VacancyReview.message_id == review.message_id
+  """Save reviews and create initial progress records for approved ones.
+
+  Reviews are upserted on `message_id` with chunked INSERT ... ON CONFLICT
+  DO UPDATE, and missing progress rows are added by a single INSERT ...
+  SELECT ... WHERE NOT EXISTS, so the SQLite write lock is only held for a
+  few statements. Commits.
+  """
+  for start in range(0, len(reviews), REVIEW_CHUNK_SIZE):
+    chunk = reviews[start : start + REVIEW_CHUNK_SIZE]
+    statement = insert(VacancyReview).values(
+      [
+        {"message_id": review.message_id}
+        | {column: getattr(review, column) for column in _REVIEW_UPDATE_COLUMNS}
+        for review in chunk
+      ]
+    )
+    statement = statement.on_conflict_do_update(
+      index_elements=["message_id"],
+      set_={column: statement.excluded[column] for column in _REVIEW_UPDATE_COLUMNS},
+    )
+    session.execute(statement)
+
+  if reviews:
+    approved = select(VacancyReview.id).where(
+      VacancyReview.message_id.in_({r.message_id for r in reviews}),  # type: ignore[attr-defined]
+      VacancyReview.decision == VacancyReviewDecision.APPROVE,
+      ~exists().where(VacancyProgress.review_id == VacancyReview.id),
     )
-    existing_review = session.exec(existing_statement).first()
-
-    if existing_review:
-      # Update existing review fields
-      for key, value in review.model_dump(exclude={"id"}).items():
-        setattr(existing_review, key, value)
-      review = existing_review
-    else:
-      session.add(review)
-
-    session.flush()
-
-    # Create progress only if it doesn't exist and decision is APPROVE
-    if review.decision == VacancyReviewDecision.APPROVE:
-      existing_progress = session.exec(
-        select(VacancyProgress).where(VacancyProgress.review_id == review.id)
-      ).first()
-      if not existing_progress:
-        progress = VacancyProgress(review_id=review.id)
-        session.add(progress)
+    session.execute(insert(VacancyProgress).from_select(["review_id"], approved))
 
   session.commit()
+
+
+def clone_known_reviews(
+  session: Session,
+  messages: list[Message],
+  prompt_id: int | None,
+  prompt_version: int | None,
+) -> set[int]:
+  """Reuse reviews of identical or near-duplicate texts by the same prompt version.
+
+  Each message whose `text_hash` or SimHash matches a message already
+  reviewed by this prompt version gets a copy of that review's
+  classification (and its own progress record if approved) instead of a
+  model call. Returns the ids of
+  messages that got a cloned review.
+  """
+  if prompt_id is None:
+    return set()
+  hashes = {m.text_hash for m in messages if m.text_hash}
+  near_filter = _near_duplicate_filter(messages)
+  if not hashes and near_filter is None:
+    return set()
+
+  conditions = []
+  if hashes:
+    conditions.append(Message.text_hash.in_(hashes))  # type: ignore[union-attr]
+  if near_filter is not None:
+    conditions.append(near_filter)
+  # One source per distinct text is enough, so reposts of a popular text do
+  # not crowd out the sources of other texts
+  source_ids = (
+    select(func.min(Message.id))
+    .join(VacancyReview, VacancyReview.message_id == Message.id)
+    .where(
+      or_(*conditions),
+      VacancyReview.prompt_id == prompt_id,
+      VacancyReview.prompt_version == prompt_version,
+      VacancyReview.is_stale == False,  # noqa: E712
+    )
+    .group_by(Message.text_hash)
+    .limit(MAX_CLONE_SOURCES)
+  )
+  statement = (
+    select(Message, VacancyReview)
+    .join(VacancyReview, VacancyReview.message_id == Message.id)
+    .where(Message.id.in_(source_ids))  # type: ignore[union-attr]
+  )
+  sources = _SourceIndex(session.exec(statement).all())
+
+  clones = []
+  for message in messages:
+    source = sources.find(message)
+    if source is not None:
+      clones.append(copy_review(*source, message))
+  if clones:
+    save_reviews(session, clones)
+  return {review.message_id for review in clones}
+
+
+class _SourceIndex:
+  """Reviewed messages looked up by text hash and SimHash band."""
+
+  def __init__(self, reviewed: list[tuple[Message, VacancyReview]]):
+    self._by_hash: dict[str, list[tuple[Message, VacancyReview]]] = {}
+    self._by_band: dict[tuple[int, int], list[tuple[Message, VacancyReview]]] = {}
+    for item in reviewed:
+      message = item[0]
+      if message.text_hash:
+        self._by_hash.setdefault(message.text_hash, []).append(item)
+      for key in _band_keys(message):
+        self._by_band.setdefault(key, []).append(item)
+
+  def find(self, message: Message) -> tuple[Message, VacancyReview] | None:
+    """A reviewed duplicate of the message, other than the message itself."""
+    candidates = [self._by_hash.get(message.text_hash or "", [])]
+    candidates += [self._by_band.get(key, []) for key in _band_keys(message)]
+    for items in candidates:
+      for item in items:
+        if item[0].id != message.id and _is_duplicate(item[0], message):
+          return item
+    return None
+
+
+def _band_keys(message: Message) -> list[tuple[int, int]]:
+  return [
+    (band, value)
+    for band in range(SIMHASH_BANDS)
+    if (value := getattr(message, f"simhash_band_{band}")) is not None
+  ]
+
+
+def copy_review(
+  source_message: Message, source: VacancyReview, message: Message
+) -> VacancyReview:
+  """Unsaved copy of a review for a near-duplicate message.
+
+  Only the classification is copied, contacts are rebuilt from the message
+  itself (see `duplicate_contacts`).
+  """
+  # JSON columns load back as plain dicts, which is fine to copy as is
+  values = source.model_dump(exclude={"id", "message_id", "contacts"}, warnings=False)
+  contacts = [ContactDTO.model_validate(c) for c in source.contacts]
+  return VacancyReview(
+    **values,
+    message_id=message.id,
+    contacts=duplicate_contacts(contacts, source_message, message),
+  )
+
+
+def dismiss_messages(
+  session: Session,
+  message_ids: list[int],
+  prompt_id: int | None,
+  prompt_version: int | None,
+  reviewed_by: str,
+) -> None:
+  """Store DISMISS reviews decided locally, without a model call."""
+  save_reviews(
+    session,
+    [
+      VacancyReview(
+        message_id=message_id,
+        decision=VacancyReviewDecision.DISMISS,
+        vacancy_position="",
+        vacancy_description="",
+        prompt_id=prompt_id,
+        prompt_version=prompt_version,
+        reviewed_by=reviewed_by,
+      )
+      for message_id in message_ids
+    ],
+  )
+
+
+def get_labeled_messages(
+  session: Session, limit: int, prompt_id: int | None = None
+) -> list[tuple[Message, bool]]:
+  """Latest messages reviewed by the model, as (message, approved) pairs."""
+  statement = (
+    select(Message, VacancyReview.decision)
+    .join(VacancyReview, VacancyReview.message_id == Message.id)
+    .where(
+      VacancyReview.reviewed_by == None,  # noqa: E711
+      VacancyReview.is_stale == False,  # noqa: E712
+    )
+    .order_by(Message.id.desc())  # type: ignore[union-attr]
+    .limit(limit)
+  )
+  if prompt_id is not None:
+    statement = statement.where(VacancyReview.prompt_id == prompt_id)
+  return [
+    (message, decision == VacancyReviewDecision.APPROVE)
+    for message, decision in session.exec(statement).all()
+  ]
+
+
+def enqueue_messages(
+  session: Session,
+  prompt_id: int,
+  prompt_version: int,
+  priority: int = 0,
+  account_id: int | None = None,
+  chat_id: int | None = None,
+  folder_id: int | None = None,
+  unreviewed_only: bool = True,
+) -> int:
+  """Queue matching messages for review by a prompt version in one statement.
+
+  Messages already queued for this prompt, whatever the version, are
+  skipped. Returns the number of queued messages.
+  """
+  source = _review_statement(
+    account_id,
+    chat_id,
+    folder_id,
+    unreviewed_only,
+    None,
+    statement=_queue_columns(prompt_id, prompt_version, priority),
+  )
+  # SQLite cannot tell ON CONFLICT from a join constraint after a bare SELECT
+  source = source.where(true())
+  statement = _insert_queue_items(source).on_conflict_do_nothing(
+    index_elements=["message_id", "prompt_id"]
+  )
+  count = session.execute(statement).rowcount
+  session.commit()
+  return count
+
+
+def enqueue_stale_reviews(
+  session: Session, prompt_id: int, prompt_version: int, priority: int = 0
+) -> int:
+  """Queue messages reviewed by older versions of a prompt, newest first.
+
+  Messages already queued for another version are moved to this one unless
+  a worker holds an unexpired lease on them. Moved items start over with no
+  attempts. Returns the number of queued or moved messages.
+  """
+  source = (
+    _queue_columns(prompt_id, prompt_version, priority)
+    .join(VacancyReview, VacancyReview.message_id == Message.id)
+    .where(
+      VacancyReview.prompt_id == prompt_id,
+      VacancyReview.prompt_version < prompt_version,
+    )
+    # Queue ids follow insertion order, so recent messages are claimed first
+    .order_by(Message.date.desc(), Message.id.desc())  # type: ignore[attr-defined,union-attr]
+  )
+  statement = _insert_queue_items(source)
+  statement = statement.on_conflict_do_update(
+    index_elements=["message_id", "prompt_id"],
+    set_={
+      column: statement.excluded[column]
+      for column in ("prompt_version", "priority", "attempts")
+    }
+    | {"lease_owner": None, "lease_expires_at": None},
+    where=_lease_available(utc_now())
+    & (
+      ReviewQueueItem.prompt_version.is_distinct_from(  # type: ignore[attr-defined]
+        statement.excluded.prompt_version
+      )
+    ),
+  )
+  count = session.execute(statement).rowcount
+  session.commit()
+  return count
+
+
+def count_queue_items(
+  session: Session, prompt_id: int, prompt_version: int, pending_only: bool = False
+) -> int:
+  """Messages still queued for a prompt version.
+
+  With `pending_only`, items that failed `MAX_QUEUE_ATTEMPTS` times and are
+  not leased any more are left out, since no worker claims them again.
+  """
+  statement = select(func.count()).where(
+    ReviewQueueItem.prompt_id == prompt_id,
+    ReviewQueueItem.prompt_version == prompt_version,
+  )
+  if pending_only:
+    statement = statement.where(
+      or_(
+        ReviewQueueItem.attempts < MAX_QUEUE_ATTEMPTS,
+        ~_lease_available(utc_now()),
+      )
+    )
+  return session.exec(statement).one()
+
+
+def _lease_available(now: datetime):
+  """Items nobody holds: never leased or the lease ran out."""
+  return or_(
+    ReviewQueueItem.lease_expires_at == None,  # noqa: E711
+    ReviewQueueItem.lease_expires_at < now,
+  )
+
+
+def _queue_columns(prompt_id: int, prompt_version: int, priority: int):
+  return select(
+    Message.id,
+    literal(prompt_id),
+    literal(prompt_version),
+    literal(priority),
+    literal(0),
+    literal(utc_now()),
+  )
+
+
+def _insert_queue_items(source):
+  return insert(ReviewQueueItem).from_select(
+    [
+      "message_id",
+      "prompt_id",
+      "prompt_version",
+      "priority",
+      "attempts",
+      "enqueued_at",
+    ],
+    source,
+  )
+
+
+def claim_queue_items(
+  session: Session,
+  owner: str,
+  limit: int,
+  lease_seconds: float,
+  prompt_id: int | None = None,
+  prompt_version: int | None = None,
+) -> list[ReviewQueueItem]:
+  """Lease up to `limit` available queue items of one prompt version to `owner`.
+
+  Items are picked by priority, then age, and the first of them decides the
+  prompt version, unless `prompt_id` and `prompt_version` pin it. Selection and lease happen in a single UPDATE ...
+  RETURNING, which SQLite runs under its write lock, so concurrent workers
+  never claim the same item. Expired leases are available again. Commits.
+  """
+  now = utc_now()
+  conditions = [_lease_available(now), ReviewQueueItem.attempts < MAX_QUEUE_ATTEMPTS]
+  if prompt_id is not None:
+    conditions.append(ReviewQueueItem.prompt_id == prompt_id)
+  if prompt_version is not None:
+    conditions.append(ReviewQueueItem.prompt_version == prompt_version)
+  order = (ReviewQueueItem.priority.desc(), ReviewQueueItem.id)  # type: ignore[attr-defined]
+
+  def first(column):
+    return select(column).where(*conditions).order_by(*order).limit(1).scalar_subquery()
+
+  available = (
+    select(ReviewQueueItem.id)
+    .where(
+      *conditions,
+      ReviewQueueItem.prompt_id == first(ReviewQueueItem.prompt_id),
+      ReviewQueueItem.prompt_version == first(ReviewQueueItem.prompt_version),
+    )
+    .order_by(*order)
+    .limit(limit)
+  )
+
+  statement = (
+    update(ReviewQueueItem)
+    .where(ReviewQueueItem.id.in_(available.scalar_subquery()))  # type: ignore[union-attr]
+    .values(
+      lease_owner=owner,
+      lease_expires_at=now + timedelta(seconds=lease_seconds),
+      attempts=ReviewQueueItem.attempts + 1,
+    )
+    .returning(ReviewQueueItem)
+  )
+  items = list(session.scalars(statement).all())
+  session.commit()
+  return items
+
+
+def ack_queue_items(
+  session: Session, owner: str, prompt_id: int, message_ids: list[int]
+) -> set[int]:
+  """Drop finished items of a prompt still leased by `owner`. Does not commit.
+
+  Returns the ids of the dropped items. Items leased again meanwhile, or
+  queued anew because their message was edited, are kept.
+  """
+  if not message_ids:
+    return set()
+  statement = (
+    delete(ReviewQueueItem)
+    .where(
+      ReviewQueueItem.message_id.in_(message_ids),  # type: ignore[attr-defined]
+      ReviewQueueItem.prompt_id == prompt_id,
+      ReviewQueueItem.lease_owner == owner,
+    )
+    .returning(ReviewQueueItem.message_id)
+  )
+  return set(session.scalars(statement).all())
+
+
+def release_queue_items(
+  session: Session, owner: str, prompt_id: int, message_ids: list[int]
+) -> None:
+  """Hand leased items back to the queue without counting an attempt. Commits."""
+  if message_ids:
+    session.execute(
+      update(ReviewQueueItem)
+      .where(
+        ReviewQueueItem.message_id.in_(message_ids),  # type: ignore[attr-defined]
+        ReviewQueueItem.prompt_id == prompt_id,
+        ReviewQueueItem.lease_owner == owner,
+      )
+      .values(
+        lease_owner=None,
+        lease_expires_at=None,
+        attempts=ReviewQueueItem.attempts - 1,
+      )
+    )
+    session.commit()
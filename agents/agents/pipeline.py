@@ -0,0 +1,190 @@
+import asyncio
+from asyncio import FIRST_COMPLETED
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+from pydantic_ai.exceptions import ModelHTTPError
+
+# HTTP statuses the model provider uses to say "slow down"
+THROTTLE_STATUS_CODES = {429, 503, 504}
+# Recent request latencies kept to learn deadlines and hedging thresholds
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+# Requests slower than this percentile of recent ones get a duplicate
+HEDGE_PERCENTILE = 0.95
+# Request deadline while nothing is learned yet, and bounds of learned ones
+DEFAULT_TIMEOUT = 180.0
+MIN_TIMEOUT = 30.0
+MAX_TIMEOUT = 600.0
+# A request is abandoned after this many times the p99 latency
+TIMEOUT_FACTOR = 3
+
+T = TypeVar("T")
+
+
+class AdaptiveLimiter:
+  """Concurrency limit that adapts to the provider's rate limit (AIMD).
+
+  Every `limit` successful requests raise the limit by one, a throttled
+  request halves it. Requests already in flight are never cancelled when
+  the limit drops, new ones just wait until enough of them finished.
+  """
+
+  def __init__(self, initial: int, maximum: int, minimum: int = 1):
+    self.minimum = max(1, minimum)
+    self.maximum = max(self.minimum, maximum)
+    self.limit = min(max(initial, self.minimum), self.maximum)
+    self.in_flight = 0
+    self._successes = 0
+    self._changed = asyncio.Condition()
+
+  async def acquire(self) -> None:
+    async with self._changed:
+      await self._changed.wait_for(lambda: self.in_flight < self.limit)
+      self.in_flight += 1
+
+  async def try_acquire(self) -> bool:
+    """Take a slot only if one is free right now."""
+    async with self._changed:
+      if self.in_flight >= self.limit:
+        return False
+      self.in_flight += 1
+      return True
+
+  async def release(self, throttled: bool = False) -> None:
+    async with self._changed:
+      self.in_flight -= 1
+      if throttled:
+        self.limit = max(self.minimum, self.limit // 2)
+        self._successes = 0
+      else:
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.maximum:
+          self.limit += 1
+          self._successes = 0
+      self._changed.notify_all()
+
+
+def percentile(values: list[float], fraction: float) -> float:
+  """Value below which `fraction` of the non-empty `values` lie."""
+  values = sorted(values)
+  return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def is_throttled(error: BaseException) -> bool:
+  """Whether a model call failed because of rate limiting or a timeout."""
+  if isinstance(error, TimeoutError):
+    return True
+  return isinstance(error, ModelHTTPError) and (
+    error.status_code in THROTTLE_STATUS_CODES
+  )
+
+
+async def retry_throttled(
+  limiter: AdaptiveLimiter, call: Callable[[], Awaitable[T]], retries: int
+) -> T:
+  """Await `call()` in an acquired limiter slot, retrying rate limits.
+
+  A rate limited or timed out call is retried up to `retries` times with
+  exponential backoff, each time in a newly acquired slot. The slot is
+  released before returning or raising.
+  """
+  attempt = 0
+  while True:
+    try:
+      result = await call()
+    except Exception as e:
+      throttled = is_throttled(e)
+      await limiter.release(throttled=throttled)
+      if not throttled or attempt == retries:
+        raise
+    else:
+      await limiter.release()
+      return result
+    attempt += 1
+    await asyncio.sleep(2**attempt)
+    await limiter.acquire()
+
+
+class LatencyTracker:
+  """Rolling window of model request latencies.
+
+  Learns how long a request may take before a duplicate is sent (the p95)
+  and before it is abandoned (a multiple of the p99). Until enough samples
+  are collected, requests get the default deadline and are not hedged.
+  """
+
+  def __init__(self, window: int = LATENCY_WINDOW):
+    self._samples: deque[float] = deque(maxlen=window)
+
+  def record(self, seconds: float) -> None:
+    self._samples.append(seconds)
+
+  def percentile(self, fraction: float) -> float | None:
+    if len(self._samples) < MIN_LATENCY_SAMPLES:
+      return None
+    return percentile(list(self._samples), fraction)
+
+  def hedge_after(self) -> float | None:
+    return self.percentile(HEDGE_PERCENTILE)
+
+  def timeout(self) -> float:
+    p99 = self.percentile(0.99)
+    if p99 is None:
+      return DEFAULT_TIMEOUT
+    return min(max(p99 * TIMEOUT_FACTOR, MIN_TIMEOUT), MAX_TIMEOUT)
+
+
+async def run_hedged(
+  call: Callable[[], Awaitable[T]],
+  latencies: LatencyTracker,
+  hedge: bool = True,
+  limiter: AdaptiveLimiter | None = None,
+) -> tuple[T, bool]:
+  """Await `call()` within the learned deadline, hedging slow requests.
+
+  With `hedge`, a request still running after the p95 latency gets one
+  duplicate and whichever finishes first wins; the other is cancelled.
+  With a `limiter` the duplicate needs a free slot of its own, which it
+  holds until the request is over, or it is not sent at all.
+  Returns the result and whether a duplicate was sent. Raises TimeoutError
+  past the deadline, or the error of the last failed request.
+  """
+  loop = asyncio.get_running_loop()
+  started = loop.time()
+  deadline = started + latencies.timeout()
+  hedge_at = latencies.hedge_after() if hedge else None
+  tasks = {asyncio.create_task(call()): started}
+  hedged = False
+  error: BaseException | None = None
+  try:
+    while tasks:
+      wait_until = deadline
+      if hedge_at is not None and not hedged:
+        wait_until = min(deadline, started + hedge_at)
+      done, _ = await asyncio.wait(
+        tasks, timeout=max(0.0, wait_until - loop.time()), return_when=FIRST_COMPLETED
+      )
+      for task in done:
+        task_started = tasks.pop(task)
+        if task.exception() is None:
+          latencies.record(loop.time() - task_started)
+          return task.result(), hedged
+        error = task.exception()
+      if done:
+        continue
+      if hedged or hedge_at is None or loop.time() >= deadline:
+        raise TimeoutError(f"Model request took longer than {deadline - started:.0f}s")
+      if limiter is not None and not await limiter.try_acquire():
+        # No spare capacity, keep waiting for the first request alone
+        hedge_at = None
+        continue
+      hedged = True
+      tasks[asyncio.create_task(call())] = loop.time()
+    assert error is not None
+    raise error
+  finally:
+    for task in tasks:
+      task.cancel()
+    if hedged and limiter is not None:
+      await limiter.release()
@@ -0,0 +1,174 @@
+import json
+import math
+import os
+import random
+import re
+import zlib
+from typing import Protocol
+from shared.models import Message
+from shared.text import normalize_text
+
+# Messages shorter than this (in words) are dismissed by the rules unless they
+# mention a vacancy keyword
+MIN_WORDS = 6
+# Substrings that keep a short message in the review (lowercase)
+VACANCY_KEYWORDS = (
+  "ваканс",
+  "ищем",
+  "требует",
+  "зарплат",
+  "оклад",
+  "резюме",
+  "hiring",
+  "vacancy",
+  "we are looking",
+  "salary",
+  "job",
+  "position",
+  "resume",
+)
+
+# Hashed bag-of-words size of the linear classifier
+FEATURE_BUCKETS = 1 << 18
+# Default location of the trained classifier weights
+MODEL_PATH = os.getenv("PREFILTER_MODEL_PATH", "prefilter.json")
+# Messages scored below this approve probability are dismissed. Kept low, so
+# the classifier only drops messages it is very sure about
+DEFAULT_THRESHOLD = 0.02
+
+_URL = re.compile(r"https?://\S+|t\.me/\S+|www\.\S+")
+_WORD = re.compile(r"\w+")
+
+
+class Prefilter(Protocol):
+  """Local check that runs before the model and dismisses plain non-vacancies."""
+
+  name: str
+
+  def rejects(self, message: Message) -> bool: ...
+
+
+class RulePrefilter:
+  """Dismisses empty, link-only and short messages without vacancy keywords."""
+
+  name = "rules"
+
+  def __init__(self, min_words: int = MIN_WORDS, keywords=VACANCY_KEYWORDS):
+    self.min_words = min_words
+    self.keywords = keywords
+
+  def rejects(self, message: Message) -> bool:
+    text = normalize_text(message.text or "")
+    words = _WORD.findall(_URL.sub(" ", text))
+    if not words:
+      return True
+    if len(words) >= self.min_words:
+      return False
+    return not any(keyword in text for keyword in self.keywords)
+
+
+class LinearPrefilter:
+  """Logistic regression over hashed words, trained on past review decisions.
+
+  Predicts the probability that the model would approve a message and
+  dismisses it when that is below `threshold`.
+  """
+
+  name = "linear"
+
+  def __init__(
+    self, weights: dict[int, float] | None = None, threshold: float = DEFAULT_THRESHOLD
+  ):
+    self.weights = weights or {}
+    self.threshold = threshold
+
+  def rejects(self, message: Message) -> bool:
+    return self.predict(message.text) < self.threshold
+
+  def predict(self, text: str | None) -> float:
+    """Probability that a text is a vacancy."""
+    score = sum(self.weights.get(f, 0.0) for f in _features(text))
+    return 1 / (1 + math.exp(-max(min(score, 30.0), -30.0)))
+
+  @classmethod
+  def train(
+    cls,
+    samples: list[tuple[str | None, bool]],
+    epochs: int = 5,
+    learning_rate: float = 0.1,
+    l2: float = 1e-6,
+    threshold: float = DEFAULT_THRESHOLD,
+  ) -> "LinearPrefilter":
+    """Fit on (text, approved) pairs with plain SGD."""
+    model = cls(threshold=threshold)
+    samples = list(samples)
+    rng = random.Random(0)
+    for _ in range(epochs):
+      rng.shuffle(samples)
+      for text, approved in samples:
+        features = _features(text)
+        error = model.predict(text) - (1.0 if approved else 0.0)
+        for f in features:
+          weight = model.weights.get(f, 0.0)
+          model.weights[f] = weight - learning_rate * (error + l2 * weight)
+    return model
+
+  def save(self, path: str) -> None:
+    with open(path, "w") as f:
+      json.dump({"threshold": self.threshold, "weights": self.weights}, f)
+
+  @classmethod
+  def load(cls, path: str) -> "LinearPrefilter":
+    with open(path) as f:
+      data = json.load(f)
+    weights = {int(k): v for k, v in data["weights"].items()}
+    return cls(weights, threshold=data["threshold"])
+
+
+def get_prefilter(name: str, model_path: str = MODEL_PATH) -> Prefilter:
+  """Prefilter by name: "rules" or "linear" (loaded from `model_path`)."""
+  if name == RulePrefilter.name:
+    return RulePrefilter()
+  if name == LinearPrefilter.name:
+    return LinearPrefilter.load(model_path)
+  raise ValueError(f"Unknown prefilter: {name}")
+
+
+def _features(text: str | None) -> list[int]:
+  """Hashed word features plus a few shape features, and a bias."""
+  text = normalize_text(text or "")
+  words = _WORD.findall(_URL.sub(" ", text))
+  tokens = {f"w:{word}" for word in words}
+  tokens.add(f"len:{min(len(words).bit_length(), 10)}")
+  if _URL.search(text):
+    tokens.add("has:url")
+  if "@" in text:
+    tokens.add("has:mention")
+  if any(c.isdigit() for c in text):
+    tokens.add("has:digit")
+  return [0] + [zlib.crc32(t.encode()) % (FEATURE_BUCKETS - 1) + 1 for t in tokens]
+
+
+def evaluate(prefilter: Prefilter, samples: list[tuple[Message, bool]]) -> dict:
+  """Compare prefilter dismissals with past model decisions.
+
+  `samples` are (message, approved) pairs. Precision is the share of
+  dismissed messages the model also dismissed; recall is the share of the
+  model's dismissals the prefilter catches. `lost_approvals` counts
+  vacancies the prefilter would have dropped.
+  """
+  rejected = dismissed = both = lost = 0
+  for message, approved in samples:
+    rejects = prefilter.rejects(message)
+    rejected += rejects
+    dismissed += not approved
+    both += rejects and not approved
+    lost += rejects and approved
+  return {
+    "prefilter": prefilter.name,
+    "samples": len(samples),
+    "rejected": rejected,
+    "precision": round(both / rejected, 4) if rejected else 1.0,
+    "recall": round(both / dismissed, 4) if dismissed else 0.0,
+    "lost_approvals": lost,
+  }
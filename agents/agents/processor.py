@@ -1,5 +1,11 @@
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent
+from pydantic_ai.exceptions import UnexpectedModelBehavior
+from .contacts import extract_contacts, merge_contacts
+from .pipeline import AdaptiveLimiter, LatencyTracker, percentile, run_hedged
 from shared.models import (
   Message,
   VacancyReviewDecision,
@@ -9,14 +15,13 @@ from shared.models import (
 )
 
 
-class MessageReviewOutput(BaseModel):
-  """Structured output for a single message review."""
+class ApprovedReviewOutput(BaseModel):
+  """Structured output for a message that matches the vacancy criteria."""
 
   index: int = Field(description="Index of the message from the input list")
-  decision: VacancyReviewDecision
   seniority: Seniority | None = Field(
     default=None,
-    description="Seniority level: TRAINEE, JUNIOR, MIDDLE, SENIOR, LEAD. MUST be provided if decision is APPROVE.",
+    description="Seniority level: TRAINEE, JUNIOR, MIDDLE, SENIOR, LEAD. MUST be provided.",
   )
   experience: Experience | None = Field(
     default=None,
@@ -34,32 +39,144 @@ class MessageReviewOutput(BaseModel):
   salary_fork_to: int | None = None
 
 
+class MessageReviewOutput(ApprovedReviewOutput):
+  """Review of a single message, expanded from the model output."""
+
+  decision: VacancyReviewDecision
+
+
 class BatchReviewOutput(BaseModel):
-  """Structured output for a batch of message reviews."""
+  """Reviews of a batch of messages."""
 
   reviews: list[MessageReviewOutput]
 
 
-def get_agent(system_prompt: str) -> Agent[None, BatchReviewOutput]:
-  """Create an agent with the given system prompt."""
-  return Agent(
-    "google-gla:gemini-3-flash-preview",
-    output_type=BatchReviewOutput,
-    system_prompt=system_prompt,
+class ReviewOutput(BaseModel):
+  """Structured output for a batch of message reviews.
+
+  Most messages are dismissed, so they are listed by index only and full
+  objects are spent on approvals alone.
+  """
+
+  dismissed: list[int] = Field(
+    default_factory=list, description="Indices of messages that are dismissed"
+  )
+  approved: list[ApprovedReviewOutput] = Field(
+    default_factory=list, description="Reviews of the approved messages"
   )
 
+  def expand(self, complete: bool = True) -> list[MessageReviewOutput]:
+    """Reviews of every listed message, dismissals first.
 
-async def process_messages(
-  messages: list[Message], system_prompt: str
-) -> BatchReviewOutput:
-  """Process a batch of messages using the AI agent."""
-  if not messages:
-    return BatchReviewOutput(reviews=[])
+    A message listed in both lists counts as approved. Unless `complete`,
+    the last entry of each list is skipped, since it may still be growing
+    in a partially streamed output.
+    """
+    end = None if complete else -1
+    approved = {review.index for review in self.approved[:end]}
+    return [
+      MessageReviewOutput(index=index, decision=VacancyReviewDecision.DISMISS)
+      for index in self.dismissed[:end]
+      if index not in approved
+    ] + [
+      MessageReviewOutput(**dict(review), decision=VacancyReviewDecision.APPROVE)
+      for review in self.approved[:end]
+    ]
+
+
+# Token budgets of a single model request, used to pack review batches
+INPUT_TOKEN_BUDGET = 12_000
+OUTPUT_TOKEN_BUDGET = 8_000
+MAX_BATCH_MESSAGES = 50
+# Conservative for mixed Latin/Cyrillic text, so budgets are rarely overshot
+CHARS_PER_TOKEN = 3
+# Expected output of one review: a DISMISS is just its index, an APPROVE grows
+# with the post
+OUTPUT_TOKENS_PER_REVIEW = 8
+MAX_OUTPUT_TOKENS_PER_REVIEW = 600
 
-  system_prompt += """
-**Instructions:**
-1. Set 'decision' to 'APPROVE' only if it matches the above criteria.
-2. For approved vacancies, extract: position, description, seniority, experience, requirements, salary range, and contacts.
+
+class BatchStats(BaseModel):
+  """Size and token usage of one review request."""
+
+  messages: int
+  estimated_input_tokens: int
+  estimated_output_tokens: int
+  input_tokens: int | None = None
+  output_tokens: int | None = None
+  # Input tokens served from the provider's prompt cache
+  cache_read_tokens: int | None = None
+  elapsed: float = 0.0
+  # Whether a duplicate request was sent because this one was slow
+  hedged: bool = False
+
+
+def summarize_stats(stats: list[BatchStats]) -> dict:
+  """Aggregate batch statistics of a review run."""
+  if not stats:
+    return {"batches": 0}
+  batches = len(stats)
+  return {
+    "batches": batches,
+    "avg_messages": round(sum(s.messages for s in stats) / batches, 1),
+    "estimated_input_tokens": sum(s.estimated_input_tokens for s in stats),
+    "input_tokens": sum(s.input_tokens or 0 for s in stats),
+    "estimated_output_tokens": sum(s.estimated_output_tokens for s in stats),
+    "output_tokens": sum(s.output_tokens or 0 for s in stats),
+    "cache_read_tokens": sum(s.cache_read_tokens or 0 for s in stats),
+    "max_output_tokens": max(s.output_tokens or 0 for s in stats),
+    "avg_elapsed": round(sum(s.elapsed for s in stats) / batches, 3),
+    "p50_elapsed": percentile([s.elapsed for s in stats], 0.5),
+    "p95_elapsed": percentile([s.elapsed for s in stats], 0.95),
+    "hedged": sum(s.hedged for s in stats),
+  }
+
+
+def estimate_tokens(text: str) -> int:
+  """Cheap local token estimate, no tokenizer round trip needed."""
+  return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_output_tokens(message: Message) -> int:
+  """Expected output tokens of a review, longer posts yield longer extractions."""
+  return min(
+    OUTPUT_TOKENS_PER_REVIEW + estimate_tokens(message.text or "") // 4,
+    MAX_OUTPUT_TOKENS_PER_REVIEW,
+  )
+
+
+def pack_batch(
+  messages: list[Message],
+  input_budget: int = INPUT_TOKEN_BUDGET,
+  output_budget: int = OUTPUT_TOKEN_BUDGET,
+) -> list[Message]:
+  """Longest prefix of `messages` that fits the token budgets.
+
+  Always returns at least one message, so an oversized post is still sent
+  alone instead of blocking the queue.
+  """
+  batch: list[Message] = []
+  input_tokens = output_tokens = 0
+  for message in messages[:MAX_BATCH_MESSAGES]:
+    input_tokens += estimate_tokens(_format_message(len(batch), message))
+    output_tokens += estimate_output_tokens(message)
+    if batch and (input_tokens > input_budget or output_tokens > output_budget):
+      break
+    batch.append(message)
+  return batch
+
+
+def _format_message(index: int, msg: Message) -> str:
+  sender_info = f"Sender ID: {msg.from_id}"
+  # Note: If we decide to add username to Message model, we'd include it here
+  return f"INDEX: {index}\n{sender_info}\nText: {msg.text}\n---\n"
+
+
+# Fixed part of every review prompt. It goes first, so all prompts and
+# versions share it as a prefix the provider can cache
+REVIEW_INSTRUCTIONS = """**Instructions:**
+1. Approve a message only if it matches the vacancy criteria below. List the INDEX of every other message in 'dismissed', nothing else is needed for them.
+2. Add an entry to 'approved' for every approved vacancy and extract: position, description, seniority, experience, requirements, salary range, and contacts.
 3. 'seniority' is MANDATORY for approved vacancies. It should be one of: TRAINEE, JUNIOR, MIDDLE, SENIOR, LEAD. 
    - If there is no direct hint in the message, you MUST infer it from the requirements, salary, or responsibilities described.
    - For example, if it mentions "3+ years", "architect", or "mentoring", it's likely SENIOR or LEAD. 
@@ -71,23 +188,181 @@ async def process_messages(
    - If not mentioned, set both to null or leave as null.
 5. 'vacancy_requirements' should be a list of strings, each string representing a single requirement.
 
-4. Contacts should be objects with 'type' and 'value'.
-   **Use the following keys for 'type':**
-   - PHONE: Mobile phone number
-   - EMAIL: Email address
-   - TELEGRAM_USERNAME: Username in telegram, usually starts with @
+4. Contacts should be objects with 'type' and 'value'. Phone numbers, emails, @usernames, t.me links and hh.ru or LinkedIn links written plainly are extracted automatically, do not list them.
+   **Only add these, using the following keys for 'type':**
    - TELEGRAM_ID: Numerical ID of the sender. Use this if the message suggests contacting the sender directly (e.g., "DM me", "write to PM"). Use the provided 'Sender ID' for this.
-   - EXTERNAL_PLATFORM: Link to vacancy on head hunting platform (e.g. hh.ru, linkedin, etc.)
+   - PHONE, EMAIL, TELEGRAM_USERNAME, EXTERNAL_PLATFORM: Only for contacts that are disguised or spelled out (e.g. "name at gmail dot com").
    - OTHER: Use this for any other contact type not listed above.
-5. If dismissed, set 'decision' to 'DISMISS' and leave other fields empty/default.
+5. Every INDEX goes either to 'dismissed' or to 'approved', exactly once.
 """
 
+# Latencies of model requests in this process, they set deadlines and hedging
+latencies = LatencyTracker()
+
+# Built agents kept per prompt version, least recently used are dropped first
+AGENT_CACHE_SIZE = 16
+_agents: OrderedDict[tuple, tuple[Agent[None, ReviewOutput], str]] = OrderedDict()
+
+
+def build_system_prompt(criteria: str) -> str:
+  """Full system prompt: the fixed instructions, then the prompt's criteria."""
+  return f"{REVIEW_INSTRUCTIONS}\n**Vacancy criteria:**\n{criteria}\n"
+
+
+def get_review_agent(
+  criteria: str, prompt_id: int | None = None, prompt_version: int | None = None
+) -> tuple[Agent[None, ReviewOutput], str]:
+  """Agent and full system prompt of a prompt version, built once and reused.
+
+  Prompt versions are immutable, so (prompt_id, prompt_version) identifies
+  the criteria. Without a prompt id the criteria text itself is the key.
+  """
+  key = (prompt_id, prompt_version) if prompt_id is not None else (None, criteria)
+  cached = _agents.get(key)
+  if cached is None:
+    system_prompt = build_system_prompt(criteria)
+    cached = (get_agent(system_prompt), system_prompt)
+    _agents[key] = cached
+    while len(_agents) > AGENT_CACHE_SIZE:
+      _agents.popitem(last=False)
+  _agents.move_to_end(key)
+  return cached
+
+
+def get_agent(system_prompt: str) -> Agent[None, ReviewOutput]:
+  """Create an agent with the given system prompt."""
+  return Agent(
+    "google-gla:gemini-3-flash-preview",
+    output_type=ReviewOutput,
+    system_prompt=system_prompt,
+  )
+
+
+async def process_messages(
+  messages: list[Message],
+  system_prompt: str,
+  stats: list[BatchStats] | None = None,
+  prompt_id: int | None = None,
+  prompt_version: int | None = None,
+  hedge: bool = False,
+  limiter: AdaptiveLimiter | None = None,
+) -> BatchReviewOutput:
+  """Process a batch of messages using the AI agent.
+
+  `system_prompt` holds the vacancy criteria; the agent built from it is
+  cached per prompt version. Contacts plain patterns can find are extracted
+  locally and merged into approved reviews. Size and token usage of the
+  request are appended to `stats` if given.
+
+  The request is abandoned with a TimeoutError after the deadline learned
+  in `latencies`; with `hedge` a slow request gets a duplicate (see
+  `pipeline.run_hedged`), which takes a slot of `limiter` if given. A
+  batch whose output fails validation is split in halves that are reviewed
+  separately, down to single messages, which are skipped if they still
+  fail. Other errors of a half, such as rate limits, propagate, so the
+  caller retries the whole batch.
+  """
+  if not messages:
+    return BatchReviewOutput(reviews=[])
+
+  prompt = _build_prompt(messages)
+  agent, instructions = get_review_agent(system_prompt, prompt_id, prompt_version)
+  started = time.perf_counter()
+  try:
+    result, hedged = await run_hedged(
+      lambda: agent.run(prompt), latencies, hedge, limiter
+    )
+  except UnexpectedModelBehavior as e:
+    if len(messages) == 1:
+      print(f"Skipping message {messages[0].id}, its review is invalid: {e}")
+      return BatchReviewOutput(reviews=[])
+    middle = len(messages) // 2
+    args = (system_prompt, stats, prompt_id, prompt_version, hedge, limiter)
+    left = await process_messages(messages[:middle], *args)
+    right = await process_messages(messages[middle:], *args)
+    for review in right.reviews:
+      review.index += middle
+    return BatchReviewOutput(reviews=left.reviews + right.reviews)
+
+  if stats is not None:
+    stats.append(_batch_stats(messages, instructions + prompt, result.usage(), started))
+    stats[-1].hedged = hedged
+  reviews = result.output.expand()
+  return BatchReviewOutput(reviews=[_add_local_contacts(r, messages) for r in reviews])
+
+
+async def stream_messages(
+  messages: list[Message],
+  system_prompt: str,
+  stats: list[BatchStats] | None = None,
+  prompt_id: int | None = None,
+  prompt_version: int | None = None,
+) -> AsyncIterator[MessageReviewOutput]:
+  """Like `process_messages`, but yield every review as soon as it is complete.
+
+  Reviews are taken from the partially validated streamed output, where
+  all but the last entry of each list are final. If the stream breaks off,
+  the reviews yielded so far remain valid. A message the model lists in
+  both lists counts as approved like in `ReviewOutput.expand`, so its
+  approval follows if its dismissal was yielded already.
+  """
+  if not messages:
+    return
+
+  prompt = _build_prompt(messages)
+  agent, instructions = get_review_agent(system_prompt, prompt_id, prompt_version)
+  started = time.perf_counter()
+  yielded: dict[int, VacancyReviewDecision] = {}
+
+  def is_new(review: MessageReviewOutput) -> bool:
+    previous = yielded.get(review.index)
+    if previous == VacancyReviewDecision.APPROVE or previous == review.decision:
+      return False
+    yielded[review.index] = review.decision
+    return True
+
+  async with agent.run_stream(prompt) as result:
+    async for partial in result.stream_output(debounce_by=None):
+      for review in partial.expand(complete=False):
+        if is_new(review):
+          yield _add_local_contacts(review, messages)
+    for review in (await result.get_output()).expand():
+      if is_new(review):
+        yield _add_local_contacts(review, messages)
+    if stats is not None:
+      stats.append(
+        _batch_stats(messages, instructions + prompt, result.usage(), started)
+      )
+
+
+def _add_local_contacts(
+  review: MessageReviewOutput, messages: list[Message]
+) -> MessageReviewOutput:
+  """Put the contacts found by `contacts.extract_contacts` before the model's."""
+  if review.decision == VacancyReviewDecision.APPROVE and (
+    0 <= review.index < len(messages)
+  ):
+    local = extract_contacts(messages[review.index].text)
+    review.contacts = merge_contacts(local, review.contacts)
+  return review
+
+
+def _build_prompt(messages: list[Message]) -> str:
   prompt = "Review the following messages:\n\n"
   for i, msg in enumerate(messages):
-    sender_info = f"Sender ID: {msg.from_id}"
-    # Note: If we decide to add username to Message model, we'd include it here
-    prompt += f"INDEX: {i}\n{sender_info}\nText: {msg.text}\n---\n"
+    prompt += _format_message(i, msg)
+  return prompt
 
-  agent = get_agent(system_prompt)
-  result = await agent.run(prompt)
-  return result.output
+
+def _batch_stats(
+  messages: list[Message], full_prompt: str, usage, started: float
+) -> BatchStats:
+  return BatchStats(
+    messages=len(messages),
+    estimated_input_tokens=estimate_tokens(full_prompt),
+    estimated_output_tokens=sum(estimate_output_tokens(m) for m in messages),
+    input_tokens=usage.input_tokens,
+    output_tokens=usage.output_tokens,
+    cache_read_tokens=usage.cache_read_tokens,
+    elapsed=round(time.perf_counter() - started, 3),
+  )
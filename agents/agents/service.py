@@ -1,110 +1,411 @@
+import asyncio
+import os
+import socket
+from collections.abc import AsyncIterator
+from pydantic_ai.exceptions import UnexpectedModelBehavior
 from shared.models import (
   session_context,
+  Message,
   VacancyReview,
+  VacancyReviewDecision,
   Prompt,
+  ContactDTO,
   ContactType,
+  ReviewMigration,
+  ReviewMigrationStatus,
+  utc_now,
 )
-from .db_ops import get_messages_for_review, save_reviews
-from .processor import process_messages
-from telegram.client import get_client
-from telegram.service import resolve_username
+from .contacts import duplicate_contacts
+from .db_ops import (
+  ack_queue_items,
+  claim_queue_items,
+  clone_known_reviews,
+  cluster_messages,
+  count_queue_items,
+  dismiss_messages,
+  enqueue_messages,
+  enqueue_stale_reviews,
+  get_labeled_messages,
+  get_messages_by_ids,
+  get_review_clusters,
+  release_queue_items,
+  save_reviews,
+)
+from .pipeline import AdaptiveLimiter, retry_throttled
+from .prefilter import LinearPrefilter, Prefilter, evaluate
+from .processor import (
+  MAX_BATCH_MESSAGES,
+  BatchStats,
+  MessageReviewOutput,
+  latencies,
+  pack_batch,
+  process_messages,
+  stream_messages,
+)
+from telegram.client import client_lease
+from telegram.service import resolve_usernames
 from sqlmodel import select
 
+# Batches sent to the model at once when a review starts, adapted at runtime
+DEFAULT_CONCURRENCY = 2
+MAX_CONCURRENCY = 16
+# How often a rate limited batch is retried before the review gives up
+MAX_THROTTLE_RETRIES = 5
+# Queue items a worker leased are handed to others when it takes longer
+QUEUE_LEASE_SECONDS = 10 * 60
+# Seconds a following worker waits when the queue is empty
+QUEUE_POLL_INTERVAL = 5
+# Migrations to a new prompt version yield to regular reviews in the queue
+# and run with a fixed, low number of batches in flight
+MIGRATION_PRIORITY = -1
+MIGRATION_CONCURRENCY = 2
 
-async def run_review_cycle(
-  system_prompt: str,
-  prompt_id: int | None = None,
-  prompt_version: int | None = None,
-  batch_size: int = 10,
-  account_id: int | None = None,
-  chat_id: int | None = None,
-  folder_id: int | None = None,
-  unreviewed_only: bool = True,
-) -> int:
-  """Run one cycle of message review. Returns number of messages processed."""
-  # 1. Fetch messages
+
+def _batch_ids(msg_configs: list[dict]) -> set[int]:
+  """Ids of all messages a batch reviews, near-duplicates included."""
+  return {
+    message_id
+    for cfg in msg_configs
+    for message_id in [cfg["msg_id"], *(m.id for m in cfg["duplicates"])]
+  }
+
+
+def _fetch_batch(
+  batch_size: int,
+  prompt_id: int | None,
+  prompt_version: int | None,
+  exclude_ids: set[int] | None = None,
+  prefilter: Prefilter | None = None,
+  after_id: int | None = None,
+  **filters,
+) -> tuple[list[Message], list[dict], set[int], int | None]:
+  """Load a token-budget sized batch to review along with account configs.
+
+  Reposts of already reviewed texts get a cloned review right away, and
+  clusters whose representative the prefilter rejects are dismissed right
+  away. Both are left out of the batch; their ids are returned as the third
+  item. Of each cluster of near-duplicates only the representative is sent
+  to the model, the other members are listed in its config under
+  "duplicates" and get a copy of its review. The last item is the
+  `after_id` the next batch continues from.
+  """
   with session_context() as session:
-    messages = get_messages_for_review(
-      session,
-      batch_size,
-      account_id=account_id,
-      chat_id=chat_id,
-      folder_id=folder_id,
-      unreviewed_only=unreviewed_only,
+    clusters, last_id = get_review_clusters(
+      session, batch_size, exclude_ids=exclude_ids, after_id=after_id, **filters
     )
-    if not messages:
-      return 0
-
-    # We need to keep references to messages and their clients
-    # message.dialog.account is available due to joinedload
-    msg_configs = []
-    for m in messages:
-      acc = m.dialog.account
-      msg_configs.append(
-        {
-          "msg_id": m.id,
-          "api_id": acc.api_id,
-          "api_hash": acc.api_hash,
-          "session_string": acc.session_string,
-          "account_id": acc.id,
-        }
-      )
+    clusters, settled_ids = _settle_clusters(
+      session, clusters, prompt_id, prompt_version, prefilter
+    )
+    messages = pack_batch([c[0] for c in clusters])
+    if len(messages) < len(clusters):
+      # The page holds every candidate up to `last_id`, members past it are
+      # near-duplicates pulled in. A settled representative may hand its
+      # place to one of those, so resume right before the first page
+      # message of the clusters that did not fit the token budget
+      left_over = [m.id for c in clusters[len(messages) :] for m in c]
+      page_ids = [i for i in left_over if i <= last_id]
+      if page_ids:
+        last_id = min(page_ids) - 1
+    msg_configs = _message_configs(messages, clusters)
+  return messages, msg_configs, settled_ids, last_id
+
+
+def _settle_clusters(
+  session,
+  clusters: list[list[Message]],
+  prompt_id: int | None,
+  prompt_version: int | None,
+  prefilter: Prefilter | None,
+) -> tuple[list[list[Message]], set[int]]:
+  """Clone known reviews and dismiss prefilter rejects without the model.
+
+  Returns the clusters still to review and the ids settled locally.
+  """
+  settled_ids = clone_known_reviews(
+    session, [m for c in clusters for m in c], prompt_id, prompt_version
+  )
+  clusters = [[m for m in c if m.id not in settled_ids] for c in clusters]
+  clusters = [c for c in clusters if c]
+
+  if prefilter is not None:
+    rejected = [c for c in clusters if prefilter.rejects(c[0])]
+    rejected_ids = [m.id for c in rejected for m in c]
+    if rejected_ids:
+      dismiss_messages(session, rejected_ids, prompt_id, prompt_version, prefilter.name)
+    settled_ids.update(rejected_ids)
+    clusters = [c for c in clusters if c[0].id not in settled_ids]
+  return clusters, settled_ids
+
+
+def _message_configs(
+  messages: list[Message], clusters: list[list[Message]]
+) -> list[dict]:
+  """Account configs and near-duplicates of the batch representatives."""
+  duplicates = {c[0].id: [_contact_source(m) for m in c[1:]] for c in clusters}
+  # We need to keep references to messages and their clients
+  # message.dialog.account is available due to joinedload
+  msg_configs = []
+  for m in messages:
+    acc = m.dialog.account
+    msg_configs.append(
+      {
+        "msg_id": m.id,
+        "message": _contact_source(m),
+        "api_id": acc.api_id,
+        "api_hash": acc.api_hash,
+        "session_string": acc.session_string,
+        "account_id": acc.id,
+        "duplicates": duplicates[m.id],
+      }
+    )
+  return msg_configs
+
+
+def _contact_source(message: Message) -> Message:
+  """Unbound copy of the fields contacts are built from.
+
+  The session expires loaded rows on commit, and reviews are saved after
+  it is closed.
+  """
+  return Message(id=message.id, text=message.text, from_id=message.from_id)
+
+
+async def _save_batch_output(
+  batch_output,
+  msg_configs: list[dict],
+  prompt_id: int | None,
+  prompt_version: int | None,
+  lease_owner: str | None = None,
+) -> set[int]:
+  """Save the reviews of a batch, copied to near-duplicates.
+
+  With `lease_owner` the reviewed messages also leave the review queue, in
+  the same transaction. Returns the ids of the saved messages.
+  """
+  reviews = [
+    (msg_configs[r.index], r)
+    for r in batch_output.reviews
+    if 0 <= r.index < len(msg_configs)
+  ]
+  await _save_reviews(reviews, prompt_id, prompt_version, lease_owner)
+  return _batch_ids([cfg for cfg, _ in reviews])
+
+
+async def _save_reviews(
+  reviews: list[tuple[dict, MessageReviewOutput]],
+  prompt_id: int | None,
+  prompt_version: int | None,
+  lease_owner: str | None = None,
+) -> None:
+  # Near-duplicates share the classification, but differ in contact lines
+  # and senders, so their contacts come from their own text and sender
+  entries = []
+  for cfg, review_data in reviews:
+    entries.append((cfg, cfg["msg_id"], review_data, review_data.contacts))
+    for duplicate in cfg["duplicates"]:
+      found = duplicate_contacts(review_data.contacts, cfg["message"], duplicate)
+      entries.append((cfg, duplicate.id, review_data, found))
 
-  # 2. Process with AI
-  batch_output = await process_messages(messages, system_prompt)
+  # Resolve Telegram IDs to Usernames, one batched lookup per account
+  await _resolve_telegram_ids([(cfg, found) for cfg, _, _, found in entries])
 
-  # 3. Resolve Telegram IDs to Usernames
   reviews_to_save = []
-  clients = {}
-
-  for review_data in batch_output.reviews:
-    if review_data.index < 0 or review_data.index >= len(msg_configs):
-      continue
-
-    cfg = msg_configs[review_data.index]
-
-    # Resolve any TELEGRAM_ID contacts
-    for contact in review_data.contacts:
-      if contact.type == ContactType.TELEGRAM_ID:
-        try:
-          # Get or create client for this account
-          acc_id = cfg["account_id"]
-          if acc_id not in clients:
-            clients[acc_id] = await get_client(
-              cfg["api_id"], cfg["api_hash"], cfg["session_string"], account_id=acc_id
-            )
-
-          client = clients[acc_id]
-          if contact.value.isdigit():
-            tg_id = int(contact.value)
-            username = await resolve_username(client, tg_id)
-            if username:
-              contact.type = ContactType.TELEGRAM_USERNAME
-              contact.value = username
-        except Exception:
-          pass
-
-    review = VacancyReview(
-      message_id=cfg["msg_id"],
-      decision=review_data.decision,
-      seniority=review_data.seniority,
-      experience=review_data.experience,
-      contacts=review_data.contacts,
-      vacancy_position=review_data.vacancy_position,
-      vacancy_description=review_data.vacancy_description,
-      vacancy_requirements=review_data.vacancy_requirements,
-      salary_fork_from=review_data.salary_fork_from,
-      salary_fork_to=review_data.salary_fork_to,
-      prompt_id=prompt_id,
-      prompt_version=prompt_version,
+  for _, message_id, review_data, found in entries:
+    reviews_to_save.append(
+      VacancyReview(
+        message_id=message_id,
+        decision=review_data.decision,
+        seniority=review_data.seniority,
+        experience=review_data.experience,
+        contacts=found,
+        vacancy_position=review_data.vacancy_position,
+        vacancy_description=review_data.vacancy_description,
+        vacancy_requirements=review_data.vacancy_requirements,
+        salary_fork_from=review_data.salary_fork_from,
+        salary_fork_to=review_data.salary_fork_to,
+        prompt_id=prompt_id,
+        prompt_version=prompt_version,
+      )
     )
-    reviews_to_save.append(review)
 
-  # 4. Save results
+  # Save in a worker thread, so in-flight model calls keep being served
+  await asyncio.to_thread(_write_reviews, reviews_to_save, prompt_id, lease_owner)
+
+
+def _write_reviews(
+  reviews: list[VacancyReview],
+  prompt_id: int | None = None,
+  lease_owner: str | None = None,
+) -> None:
   with session_context() as session:
-    save_reviews(session, reviews_to_save)
+    if lease_owner is not None and prompt_id is not None:
+      acked = ack_queue_items(
+        session, lease_owner, prompt_id, [r.message_id for r in reviews]
+      )
+      # A message edited or leased again meanwhile gets a review of its own
+      reviews = [r for r in reviews if r.message_id in acked]
+    save_reviews(session, reviews)
+
+
+async def _review_with_retries(
+  limiter: AdaptiveLimiter,
+  messages: list[Message],
+  system_prompt: str,
+  stats: list[BatchStats] | None,
+  prompt_id: int | None,
+  prompt_version: int | None,
+  hedge: bool = False,
+):
+  """Review a batch in an acquired limiter slot, retrying rate limits.
+
+  Timed out requests count as rate limited. The slot is released before
+  returning or raising.
+  """
+  return await retry_throttled(
+    limiter,
+    lambda: process_messages(
+      messages, system_prompt, stats, prompt_id, prompt_version, hedge, limiter
+    ),
+    MAX_THROTTLE_RETRIES,
+  )
 
-  return len(messages)
+
+async def _stream_batch(
+  limiter: AdaptiveLimiter,
+  messages: list[Message],
+  msg_configs: list[dict],
+  system_prompt: str,
+  stats: list[BatchStats] | None,
+  prompt_id: int | None,
+  prompt_version: int | None,
+  lease_owner: str | None = None,
+  hedge: bool = False,
+) -> set[int]:
+  """Review a batch with streamed output in an acquired limiter slot.
+
+  Every finished review goes to a save stage right away, which saves all
+  reviews that arrived while it was busy in one transaction. A rate limited
+  or timed out stream is retried for the messages that have no review yet.
+  If the output fails validation, those messages are reviewed without
+  streaming instead, which bisects the bad ones out. If the batch fails,
+  reviews that finished before stay saved. Reviews that fail to save are
+  reported and left out. Returns the ids of the saved messages,
+  near-duplicates included.
+  """
+  received: asyncio.Queue[tuple[dict, MessageReviewOutput] | None] = asyncio.Queue()
+  saved: set[int] = set()
+
+  async def save_stage():
+    done = False
+    while not done:
+      items = [await received.get()]
+      while not received.empty():
+        items.append(received.get_nowait())
+      done = None in items
+      reviews = [item for item in items if item is not None]
+      if not reviews:
+        continue
+      try:
+        await _save_reviews(reviews, prompt_id, prompt_version, lease_owner)
+      except Exception as e:
+        # Left unsaved like a failed batch, the stage goes on with the rest
+        print(f"Failed to save {len(reviews)} streamed reviews: {e}")
+        continue
+      saved.update(_batch_ids([cfg for cfg, _ in reviews]))
+
+  async def reviews(batch: list[Message]) -> AsyncIterator[MessageReviewOutput]:
+    if not streaming:
+      output = await process_messages(
+        batch, system_prompt, stats, prompt_id, prompt_version, hedge, limiter
+      )
+      for review in output.reviews:
+        yield review
+      return
+    async with asyncio.timeout(latencies.timeout()):
+      async for review in stream_messages(
+        batch, system_prompt, stats, prompt_id, prompt_version
+      ):
+        yield review
+
+  async def review_pending() -> None:
+    nonlocal pending, streaming
+    # Ends once a request succeeded or by raising
+    while True:
+      finished: dict[int, VacancyReviewDecision] = {}
+      try:
+        async for review in reviews([m for m, _ in pending]):
+          if not 0 <= review.index < len(pending):
+            continue
+          # Only an approval may follow, it overrides the dismissal saved
+          previous = finished.get(review.index)
+          if previous is None or (
+            previous == VacancyReviewDecision.DISMISS
+            and review.decision == VacancyReviewDecision.APPROVE
+          ):
+            finished[review.index] = review.decision
+            received.put_nowait((pending[review.index][1], review))
+        return
+      except UnexpectedModelBehavior:
+        if not streaming:
+          raise
+        # Not the provider's fault: fall back in the same slot, right away
+        streaming = False
+      finally:
+        pending = [item for i, item in enumerate(pending) if i not in finished]
+
+  saver = asyncio.create_task(save_stage())
+  pending = list(zip(messages, msg_configs))
+  streaming = True
+  try:
+    await retry_throttled(limiter, review_pending, MAX_THROTTLE_RETRIES)
+  finally:
+    received.put_nowait(None)
+    # Never let the saver replace the error of the stream
+    await asyncio.gather(saver, return_exceptions=True)
+  return saved
+
+
+async def _resolve_telegram_ids(contacts: list[tuple[dict, list[ContactDTO]]]):
+  """Replace TELEGRAM_ID contacts with usernames where they can be resolved.
+
+  IDs are deduplicated per account and resolved in a single batched call
+  per account; accounts are resolved concurrently.
+  """
+  by_account: dict[int, tuple[dict, list[ContactDTO]]] = {}
+  for cfg, found in contacts:
+    for contact in found:
+      if contact.type == ContactType.TELEGRAM_ID and contact.value.isdigit():
+        _, to_resolve = by_account.setdefault(cfg["account_id"], (cfg, []))
+        to_resolve.append(contact)
+
+  async def resolve(cfg: dict, contacts: list[ContactDTO]):
+    try:
+      async with client_lease(
+        cfg["api_id"], cfg["api_hash"], cfg["session_string"], cfg["account_id"]
+      ) as client:
+        usernames = await resolve_usernames(client, {int(c.value) for c in contacts})
+    except Exception:
+      return
+    for contact in contacts:
+      username = usernames.get(int(contact.value))
+      if username:
+        contact.type = ContactType.TELEGRAM_USERNAME
+        contact.value = username
+
+  await asyncio.gather(*(resolve(*item) for item in by_account.values()))
+
+
+def _latest_prompt(session, prompt_id: int, user_id: int) -> Prompt:
+  statement = (
+    select(Prompt)
+    .where(Prompt.id == prompt_id, Prompt.user_id == user_id)
+    .order_by(Prompt.version.desc())
+    .limit(1)
+  )
+  prompt = session.exec(statement).first()
+  if not prompt:
+    raise ValueError(f"Prompt with ID {prompt_id} not found")
+  return prompt
 
 
 async def review_messages(
@@ -115,46 +416,393 @@ async def review_messages(
   chat_id: int | None = None,
   folder_id: int | None = None,
   unreviewed_only: bool = True,
-):
+  concurrency: int = DEFAULT_CONCURRENCY,
+  max_concurrency: int = MAX_CONCURRENCY,
+  stats: list[BatchStats] | None = None,
+  prefilter: Prefilter | None = None,
+  stream: bool = False,
+  hedge: bool = False,
+) -> int:
+  """Review messages with a prompt, keeping several model batches in flight.
+
+  The number of concurrent batches starts at `concurrency` and adapts to
+  the provider: it grows while requests succeed and halves on rate limits
+  and timeouts, up to `max_concurrency`. Results of finished batches are
+  saved while later batches are still being reviewed. Batches are packed to
+  the token budgets of `processor`, their statistics go to `stats` if given.
+  Messages the `prefilter` rejects are dismissed without a model call.
+  With `stream` reviews are saved one by one as the model finishes them.
+  With `hedge` requests slower than the usual p95 get a duplicate, see
+  `processor.process_messages`. Returns the number of reviewed messages.
+  """
   # Fetch prompt content
   with session_context() as session:
-    # Get the latest version of the prompt
-    statement = (
-      select(Prompt)
-      .where(Prompt.id == prompt_id, Prompt.user_id == user_id)
-      .order_by(Prompt.version.desc())
-      .limit(1)
-    )
-    prompt = session.exec(statement).first()
-    if not prompt:
-      raise ValueError(f"Prompt with ID {prompt_id} not found")
+    prompt = _latest_prompt(session, prompt_id, user_id)
     system_prompt = prompt.content
     prompt_version = prompt.version
 
+  filters = {
+    "account_id": account_id,
+    "chat_id": chat_id,
+    "folder_id": folder_id,
+    "unreviewed_only": unreviewed_only,
+  }
+  limiter = AdaptiveLimiter(concurrency, max_concurrency)
+  # Keyset cursor: batches walk the messages in id order
+  after_id: int | None = None
+  # Messages handed out in this run. Only near-duplicates pulled in from
+  # beyond the cursor can come up again. Reviewed ones drop out of the
+  # unreviewed query by themselves, so then only unfinished ones need excluding
+  seen: set[int] = set()
+  unfinished: set[int] = set()
+  handed_out = 0
   processed_total = 0
-  while True:
-    batch_size = 10
-    if max_messages is not None:
-      remaining = max_messages - processed_total
-      if remaining <= 0:
-        break
-      batch_size = min(10, remaining)
 
-    num_processed = await run_review_cycle(
-      system_prompt,
-      prompt_id=prompt_id,
-      prompt_version=prompt_version,
-      batch_size=batch_size,
+  async def review_batch(messages: list[Message], msg_configs: list[dict]):
+    nonlocal processed_total
+    # The slot is freed before saving, so the next model call overlaps it.
+    # Failed messages stay in `unfinished`, so they are not fetched again
+    if stream:
+      ids = await _stream_batch(
+        limiter,
+        messages,
+        msg_configs,
+        system_prompt,
+        stats,
+        prompt_id,
+        prompt_version,
+        hedge=hedge,
+      )
+    else:
+      batch_output = await _review_with_retries(
+        limiter, messages, system_prompt, stats, prompt_id, prompt_version, hedge
+      )
+      ids = await _save_batch_output(
+        batch_output, msg_configs, prompt_id, prompt_version
+      )
+    processed_total += len(ids)
+    unfinished.difference_update(ids)
+
+  try:
+    async with asyncio.TaskGroup() as tasks:
+      while True:
+        batch_size = MAX_BATCH_MESSAGES
+        if max_messages is not None:
+          batch_size = min(MAX_BATCH_MESSAGES, max_messages - handed_out)
+          if batch_size <= 0:
+            break
+
+        await limiter.acquire()
+        excluded = unfinished if unreviewed_only else seen
+        messages, msg_configs, settled_ids, after_id = _fetch_batch(
+          batch_size,
+          prompt_id,
+          prompt_version,
+          exclude_ids={i for i in excluded if after_id is None or i > after_id},
+          prefilter=prefilter,
+          after_id=after_id,
+          **filters,
+        )
+        seen |= settled_ids
+        handed_out += len(settled_ids)
+        processed_total += len(settled_ids)
+        if not messages:
+          await limiter.release()
+          if settled_ids:
+            continue
+          break
+
+        ids = _batch_ids(msg_configs)
+        seen |= ids
+        unfinished |= ids
+        handed_out += len(ids)
+        tasks.create_task(review_batch(messages, msg_configs))
+  except ExceptionGroup as e:
+    # Surface the first failure like the sequential loop did
+    raise e.exceptions[0]
+
+  return processed_total
+
+
+def enqueue_reviews(
+  prompt_id: int,
+  user_id: int,
+  priority: int = 0,
+  account_id: int | None = None,
+  chat_id: int | None = None,
+  folder_id: int | None = None,
+  unreviewed_only: bool = True,
+) -> int:
+  """Queue messages for review by the latest version of a prompt.
+
+  Workers started with `run_worker` pick them up. Returns the number of
+  newly queued messages.
+  """
+  with session_context() as session:
+    prompt = _latest_prompt(session, prompt_id, user_id)
+    return enqueue_messages(
+      session,
+      prompt_id,
+      prompt.version,
+      priority=priority,
       account_id=account_id,
       chat_id=chat_id,
       folder_id=folder_id,
       unreviewed_only=unreviewed_only,
     )
-    if num_processed == 0:
-      break
 
-    processed_total += num_processed
 
-    if num_processed < batch_size:
-      break
+async def run_worker(
+  owner: str,
+  prompt_id: int | None = None,
+  prompt_version: int | None = None,
+  concurrency: int = DEFAULT_CONCURRENCY,
+  max_concurrency: int = MAX_CONCURRENCY,
+  stats: list[BatchStats] | None = None,
+  prefilter: Prefilter | None = None,
+  follow: bool = False,
+  stream: bool = False,
+  hedge: bool = False,
+) -> int:
+  """Review queued messages until the queue is drained.
+
+  Each batch is leased from the queue under `owner`, which must be unique
+  per worker, so any number of workers in any number of processes can
+  share the queue. Reviewed messages leave the queue in the same
+  transaction that saves their reviews. Items of a worker that dies or
+  fails are leased again once their lease expires, up to
+  `db_ops.MAX_QUEUE_ATTEMPTS` times. With `follow` the worker keeps
+  polling for new items instead of returning. With `prompt_id` and
+  `prompt_version` only items of that prompt or version are reviewed.
+  `stream` and `hedge` work like in `review_messages`. Returns the number of reviewed messages.
+  """
+  limiter = AdaptiveLimiter(concurrency, max_concurrency)
+  prompts: dict[tuple[int, int], str] = {}
+  processed_total = 0
+
+  async def review_batch(
+    messages: list[Message], msg_configs: list[dict], version: tuple[int, int]
+  ):
+    nonlocal processed_total
+    try:
+      if stream:
+        ids = await _stream_batch(
+          limiter,
+          messages,
+          msg_configs,
+          prompts[version],
+          stats,
+          *version,
+          lease_owner=owner,
+          hedge=hedge,
+        )
+      else:
+        batch_output = await _review_with_retries(
+          limiter, messages, prompts[version], stats, *version, hedge
+        )
+        ids = await _save_batch_output(
+          batch_output, msg_configs, *version, lease_owner=owner
+        )
+    except Exception as e:
+      # The lease runs out and another worker retries the unsaved messages
+      print(f"Worker {owner} failed a batch: {e}")
+      return
+    processed_total += len(ids)
+
+  async with asyncio.TaskGroup() as tasks:
+    while True:
+      await limiter.acquire()
+      messages, msg_configs, settled_ids, version = _claim_batch(
+        owner, prompt_id, prompt_version, prompts, prefilter
+      )
+      processed_total += len(settled_ids)
+      if messages:
+        tasks.create_task(review_batch(messages, msg_configs, version))
+        continue
+      await limiter.release()
+      if settled_ids or version is not None:
+        continue
+      if not follow:
+        break
+      await asyncio.sleep(QUEUE_POLL_INTERVAL)
+
   return processed_total
+
+
+def _claim_batch(
+  owner: str,
+  prompt_id: int | None,
+  prompt_version: int | None,
+  prompts: dict[tuple[int, int], str],
+  prefilter: Prefilter | None,
+) -> tuple[list[Message], list[dict], set[int], tuple[int, int] | None]:
+  """Lease the next batch from the review queue.
+
+  Like `_fetch_batch`, but candidates come from the queue. All items of a
+  batch belong to one prompt version. Representatives that did not fit the
+  token budget go back to the queue. Prompt contents are cached in
+  `prompts`. Returns the batch, its configs, the ids settled locally and
+  the prompt version, which is None once the queue is empty.
+  """
+  with session_context() as session:
+    items = claim_queue_items(
+      session,
+      owner,
+      MAX_BATCH_MESSAGES,
+      QUEUE_LEASE_SECONDS,
+      prompt_id=prompt_id,
+      prompt_version=prompt_version,
+    )
+    if not items:
+      return [], [], set(), None
+    version = (items[0].prompt_id, items[0].prompt_version)
+    message_ids = [i.message_id for i in items]
+    if version not in prompts:
+      prompt = session.get(Prompt, version)
+      if prompt is None:
+        # Nothing can review items of a deleted prompt version
+        ack_queue_items(session, owner, version[0], message_ids)
+        session.commit()
+        return [], [], set(), version
+      prompts[version] = prompt.content
+
+    clusters = cluster_messages(get_messages_by_ids(session, message_ids))
+    clusters, settled_ids = _settle_clusters(session, clusters, *version, prefilter)
+    # Messages deleted since they were queued are settled as well
+    settled_ids |= set(message_ids) - {m.id for c in clusters for m in c}
+    ack_queue_items(session, owner, version[0], list(settled_ids))
+    session.commit()
+
+    messages = pack_batch([c[0] for c in clusters])
+    release_queue_items(
+      session, owner, version[0], [m.id for c in clusters[len(messages) :] for m in c]
+    )
+    msg_configs = _message_configs(messages, clusters)
+  return messages, msg_configs, settled_ids, version
+
+
+def start_review_migration(
+  prompt_id: int, user_id: int, prompt_version: int | None = None
+) -> ReviewMigration:
+  """Queue reviews made by older versions of a prompt for `prompt_version`.
+
+  Defaults to the latest version. Only messages whose review is stale are
+  queued, the most recent first. An unfinished migration to the same
+  version is continued rather than started twice. Run it with
+  `run_review_migration`.
+  """
+  with session_context() as session:
+    latest = _latest_prompt(session, prompt_id, user_id)
+    version = prompt_version or latest.version
+    if not 1 <= version <= latest.version:
+      raise ValueError(f"Prompt {prompt_id} has no version {version}")
+
+    migration = session.exec(
+      select(ReviewMigration).where(
+        ReviewMigration.prompt_id == prompt_id,
+        ReviewMigration.prompt_version == version,
+        ReviewMigration.status == ReviewMigrationStatus.RUNNING,
+      )
+    ).first() or ReviewMigration(prompt_id=prompt_id, prompt_version=version)
+    migration.total += enqueue_stale_reviews(
+      session, prompt_id, version, priority=MIGRATION_PRIORITY
+    )
+    session.add(migration)
+    session.commit()
+    session.refresh(migration)
+    return migration
+
+
+async def run_review_migration(
+  migration_id: int,
+  concurrency: int = MIGRATION_CONCURRENCY,
+  stats: list[BatchStats] | None = None,
+  prefilter: Prefilter | None = None,
+) -> dict:
+  """Review the queued messages of a migration and mark it done.
+
+  Only items of the migration's prompt version are reviewed. Items of
+  failed batches, or held by other workers, are waited for until their
+  lease runs out and claimed again; the migration is done once only items
+  that failed `db_ops.MAX_QUEUE_ATTEMPTS` times are left. Progress lives in
+  the review queue, so an interrupted migration resumes where it stopped
+  when run again. Returns its progress.
+  """
+  with session_context() as session:
+    migration = session.get(ReviewMigration, migration_id)
+    if migration is None:
+      raise ValueError(f"Review migration {migration_id} not found")
+    version = (migration.prompt_id, migration.prompt_version)
+
+  while True:
+    await run_worker(
+      f"migration:{migration_id}:{socket.gethostname()}:{os.getpid()}",
+      prompt_id=version[0],
+      prompt_version=version[1],
+      concurrency=concurrency,
+      max_concurrency=concurrency,
+      stats=stats,
+      prefilter=prefilter,
+    )
+    with session_context() as session:
+      if not count_queue_items(session, *version, pending_only=True):
+        break
+    await asyncio.sleep(QUEUE_POLL_INTERVAL)
+
+  with session_context() as session:
+    migration = session.get(ReviewMigration, migration_id)
+    migration.status = ReviewMigrationStatus.DONE
+    migration.finished_at = utc_now()
+    session.add(migration)
+    session.commit()
+  return get_migration_progress(migration_id)
+
+
+def get_migration_progress(migration_id: int) -> dict:
+  """Status of a migration and how many of its messages are still queued.
+
+  Messages left once it is done failed `db_ops.MAX_QUEUE_ATTEMPTS` times.
+  """
+  with session_context() as session:
+    migration = session.get(ReviewMigration, migration_id)
+    if migration is None:
+      raise ValueError(f"Review migration {migration_id} not found")
+    remaining = count_queue_items(
+      session, migration.prompt_id, migration.prompt_version
+    )
+    return {
+      "id": migration.id,
+      "prompt_id": migration.prompt_id,
+      "prompt_version": migration.prompt_version,
+      "status": migration.status,
+      "total": migration.total,
+      "remaining": remaining,
+      "created_at": migration.created_at,
+      "finished_at": migration.finished_at,
+    }
+
+
+def train_prefilter(
+  path: str, limit: int = 50_000, prompt_id: int | None = None
+) -> dict:
+  """Train the linear prefilter on past model decisions and save it to `path`.
+
+  Every fifth sample is held out and the model is evaluated on it. Returns
+  the evaluation report.
+  """
+  with session_context() as session:
+    samples = get_labeled_messages(session, limit, prompt_id=prompt_id)
+    train = [(m.text, approved) for i, (m, approved) in enumerate(samples) if i % 5]
+    holdout = [sample for i, sample in enumerate(samples) if not i % 5]
+    model = LinearPrefilter.train(train)
+    report = evaluate(model, holdout)
+  model.save(path)
+  return report
+
+
+def evaluate_prefilter(
+  prefilter: Prefilter, limit: int = 10_000, prompt_id: int | None = None
+) -> dict:
+  """Report precision and recall of a prefilter against past model decisions."""
+  with session_context() as session:
+    return evaluate(prefilter, get_labeled_messages(session, limit, prompt_id))
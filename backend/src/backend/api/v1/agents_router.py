@@ -1,15 +1,19 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
 from typing import Any
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 
-from agents import service
+from agents import prefilter, processor, service
 from backend.auth.deps import get_current_user
 from shared.models import get_async_session, Prompt
 from . import schemas
 
 router = APIRouter(prefix="/agents", tags=["Agents"])
 
+# Running migration jobs, referenced so they are not garbage collected
+_migration_tasks: set[asyncio.Task] = set()
+
 
 @router.post("/review")
 async def review(
@@ -30,7 +34,11 @@ async def review(
   if not prompt:
     raise HTTPException(status_code=404, detail="Prompt not found or access denied")
 
+  stats: list[processor.BatchStats] = []
   try:
+    prefilter_stage = (
+      prefilter.get_prefilter(params.prefilter) if params.prefilter else None
+    )
     processed_total = await service.review_messages(
       prompt_id=params.prompt_id,
       user_id=user.id,
@@ -39,10 +47,59 @@ async def review(
       chat_id=params.chat_id,
       folder_id=params.folder_id,
       unreviewed_only=params.unreviewed_only,
+      concurrency=params.concurrency,
+      stats=stats,
+      prefilter=prefilter_stage,
+      stream=params.stream,
+      hedge=params.hedge,
     )
-  except ValueError as e:
+  except (ValueError, FileNotFoundError) as e:
     raise HTTPException(status_code=400, detail=str(e))
   except Exception as e:
     raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
 
-  return {"status": "success", "processed_total": processed_total}
+  return {
+    "status": "success",
+    "processed_total": processed_total,
+    "batches": processor.summarize_stats(stats),
+  }
+
+
+@router.post("/migrations", response_model=schemas.ReviewMigrationRead)
+async def start_migration(
+  params: schemas.ReviewMigrationRequest,
+  user: Any = Depends(get_current_user),
+):
+  """Re-review messages reviewed by older versions of a prompt in the background."""
+  try:
+    migration = service.start_review_migration(
+      params.prompt_id, user.id, params.prompt_version
+    )
+  except ValueError as e:
+    raise HTTPException(status_code=404, detail=str(e))
+
+  task = asyncio.create_task(
+    service.run_review_migration(migration.id, concurrency=params.concurrency)
+  )
+  _migration_tasks.add(task)
+  task.add_done_callback(_migration_tasks.discard)
+  return service.get_migration_progress(migration.id)
+
+
+@router.get("/migrations/{migration_id}", response_model=schemas.ReviewMigrationRead)
+async def get_migration(
+  migration_id: int,
+  user: Any = Depends(get_current_user),
+  session: AsyncSession = Depends(get_async_session),
+):
+  try:
+    progress = service.get_migration_progress(migration_id)
+  except ValueError as e:
+    raise HTTPException(status_code=404, detail=str(e))
+
+  statement = select(Prompt.id).where(
+    Prompt.id == progress["prompt_id"], Prompt.user_id == user.id
+  )
+  if (await session.execute(statement)).first() is None:
+    raise HTTPException(status_code=404, detail="Review migration not found")
+  return progress
@@ -18,6 +18,7 @@ from .progress_router import router as progress_router
 from typing import Annotated
 import asyncio
 from telegram import client as tg_client
+from telegram import listener as tg_listener
 from telegram import service as tg_service
 
 api_router = APIRouter()
@@ -148,9 +149,24 @@ async def update_account(
   for key, value in data.model_dump(exclude_unset=True).items():
     setattr(account, key, value)
 
+  # Checked before the commit, so an unauthorized account is never left
+  # flagged as listening
+  client = None
+  if data.listen_updates:
+    client = await tg_client.get_client(
+      account.api_id, account.api_hash, account.session_string, account.id
+    )
+    if not await client.is_user_authorized():
+      raise HTTPException(status_code=401, detail="Telegram account not authorized")
+
   session.add(account)
   await session.commit()
   await session.refresh(account)
+
+  if client is not None:
+    await tg_listener.start_listener(client, account.id)
+  elif data.listen_updates is not None:
+    await tg_listener.stop_listener(account.id)
   return account
 
 
@@ -166,6 +182,7 @@ async def delete_account(
   if not account or account.user_id != current_user.id:
     raise HTTPException(status_code=404, detail="Account not found")
 
+  await tg_listener.stop_listener(account.id)
   await session.delete(account)
   await session.commit()
   return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -264,13 +281,12 @@ async def get_dialogs(
   # Sync each account in parallel
   async def sync_account(account):
     try:
-      client = await tg_client.get_client(
+      async with tg_client.client_lease(
         account.api_id, account.api_hash, account.session_string, account.id
-      )
-      if not client.is_connected():
-        await client.connect()
-      if await client.is_user_authorized():
-        await tg_service.sync_dialogs(client)
+      ) as client:
+        if await client.is_user_authorized():
+          async for _ in tg_service.iter_synced_dialogs(client):
+            pass
     except Exception as e:
       print(f"Failed to sync account {account.id}: {e}")
 
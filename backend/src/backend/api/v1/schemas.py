@@ -1,4 +1,5 @@
-from pydantic import BaseModel, ConfigDict
+from typing import Literal
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from shared.models import (
   DialogType,
   PeerType,
@@ -7,6 +8,7 @@ from shared.models import (
   Experience,
   VacancyReviewDecision,
   VacancyProgressStatus,
+  ReviewMigrationStatus,
 )
 from datetime import datetime
 
@@ -30,6 +32,15 @@ class TelegramAccountConfirm(SchemaBase):
 class TelegramAccountUpdate(SchemaBase):
   name: str | None = None
   username: str | None = None
+  # Left out to keep the current setting, it cannot be cleared
+  listen_updates: bool | None = None
+
+  @field_validator("listen_updates")
+  @classmethod
+  def _listen_updates_not_null(cls, value: bool | None) -> bool:
+    if value is None:
+      raise ValueError("listen_updates must be true or false")
+    return value
 
 
 class TelegramAccountRead(SchemaBase):
@@ -40,6 +51,7 @@ class TelegramAccountRead(SchemaBase):
   phone: str
   name: str | None = None
   username: str | None = None
+  listen_updates: bool = False
 
 
 # Prompt
@@ -151,6 +163,7 @@ class VacancyReviewRead(VacancyReviewCreate):
   dialog_name: str | None = None
   prompt_id: int | None = None
   prompt_version: int | None = None
+  is_stale: bool = False
 
 
 # VacancyProgress
@@ -184,6 +197,7 @@ class TelegramFetchRequest(SchemaBase):
   max_messages: int = 1000
   folder_id: int | None = None
   dry_run: bool = False
+  concurrency: int = Field(default=4, ge=1, le=32)
 
 
 class TelegramFetchChatsRequest(SchemaBase):
@@ -233,3 +247,25 @@ class AgentReviewRequest(SchemaBase):
   account_id: int | None = None
   chat_id: int | None = None
   folder_id: int | None = None
+  concurrency: int = Field(default=2, ge=1, le=16)
+  prefilter: Literal["rules", "linear"] | None = None
+  stream: bool = False
+  hedge: bool = False
+
+
+class ReviewMigrationRequest(SchemaBase):
+  prompt_id: int
+  # Latest version of the prompt if not given
+  prompt_version: int | None = None
+  concurrency: int = Field(default=2, ge=1, le=16)
+
+
+class ReviewMigrationRead(SchemaBase):
+  id: int
+  prompt_id: int
+  prompt_version: int
+  status: ReviewMigrationStatus
+  total: int
+  remaining: int
+  created_at: datetime
+  finished_at: datetime | None = None
@@ -1,17 +1,20 @@
+from contextlib import asynccontextmanager
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
-from telegram import service
-from telegram.client import get_client
-from backend.auth.deps import get_current_user
-from shared.models import TelegramAccount, User, get_async_session
+from telegram import fetcher, service
+from telegram.client import client_lease, pool
+from backend.auth.deps import check_role, get_current_user
+from shared.models import TelegramAccount, User, UserRole, get_async_session
 from . import schemas
 from typing import Annotated
 
 router = APIRouter(prefix="/telegram", tags=["Telegram"])
 
 
-async def get_account_client(account_id: int, user_id: int, session: AsyncSession):
+@asynccontextmanager
+async def account_client(account_id: int, user_id: int, session: AsyncSession):
+  """Pooled client of a user's account, leased for the duration of a request."""
   result = await session.execute(
     select(TelegramAccount).where(
       TelegramAccount.id == account_id, TelegramAccount.user_id == user_id
@@ -21,14 +24,19 @@ async def get_account_client(account_id: int, user_id: int, session: AsyncSessio
   if not account:
     raise HTTPException(status_code=404, detail="Telegram account not found")
 
-  client = await get_client(
+  # Pooled clients come back connected and warm
+  async with client_lease(
     account.api_id, account.api_hash, account.session_string, account.id
-  )
-  if not client.is_connected():
-    await client.connect()
-  if not await client.is_user_authorized():
-    raise HTTPException(status_code=401, detail="Telegram account not authorized")
-  return client
+  ) as client:
+    if not await client.is_user_authorized():
+      raise HTTPException(status_code=401, detail="Telegram account not authorized")
+    yield client
+
+
+@router.get("/pool/stats")
+async def pool_stats(user: Annotated[User, Depends(check_role(UserRole.ADMIN))]):
+  # The pool is shared by all users' accounts
+  return pool.stats()
 
 
 @router.post("/fetch")
@@ -37,25 +45,19 @@ async def fetch(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(params.account_id, user.id, session)
-  dialogs = await service.sync_dialogs(
-    client, folder_id=params.folder_id, dry_run=params.dry_run
-  )
-  results = []
-  for dialog in dialogs:
-    messages = await service.get_messages(
+  async with account_client(params.account_id, user.id, session) as client:
+    return await fetcher.fetch_dialogs(
       client,
-      dialog,
+      service.iter_synced_dialogs(
+        client, folder_id=params.folder_id, dry_run=params.dry_run
+      ),
       params.new_only,
       params.max_messages,
       params.date_from,
       params.date_to,
       dry_run=params.dry_run,
+      concurrency=params.concurrency,
     )
-    results.append(
-      {"chat_name": dialog.name, "chat_id": dialog.id, "message_count": len(messages)}
-    )
-  return results
 
 
 @router.post("/fetch-chats")
@@ -64,11 +66,13 @@ async def fetch_chats(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(params.account_id, user.id, session)
-  dialogs = await service.sync_dialogs(
-    client, folder_id=params.folder_id, dry_run=params.dry_run
-  )
-  return [{"name": d.name, "id": d.id} for d in dialogs]
+  async with account_client(params.account_id, user.id, session) as client:
+    return [
+      {"name": d.name, "id": d.id}
+      async for d in service.iter_synced_dialogs(
+        client, folder_id=params.folder_id, dry_run=params.dry_run
+      )
+    ]
 
 
 @router.post("/fetch-messages")
@@ -77,30 +81,33 @@ async def fetch_messages(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(params.account_id, user.id, session)
-
-  # Resolve internal chat_id to telegram_id
-  from shared.models import Dialog
+  async with account_client(params.account_id, user.id, session) as client:
+    # Resolve internal chat_id to telegram_id
+    from shared.models import Dialog
+
+    result = await session.execute(
+      select(Dialog).where(
+        Dialog.id == params.chat_id, Dialog.account_id == params.account_id
+      )
+    )
+    db_dialog = result.scalar_one_or_none()
+    if not db_dialog:
+      raise HTTPException(status_code=404, detail="Dialog not found")
 
-  result = await session.execute(
-    select(Dialog).where(
-      Dialog.id == params.chat_id, Dialog.account_id == params.account_id
+    result = await service.get_messages(
+      client,
+      db_dialog.telegram_id,
+      params.new_only,
+      params.max_messages,
+      params.date_from,
+      params.date_to,
+      params.dry_run,
     )
-  )
-  db_dialog = result.scalar_one_or_none()
-  if not db_dialog:
-    raise HTTPException(status_code=404, detail="Dialog not found")
-
-  messages = await service.get_messages(
-    client,
-    db_dialog.telegram_id,
-    params.new_only,
-    params.max_messages,
-    params.date_from,
-    params.date_to,
-    params.dry_run,
-  )
-  return {"message_count": len(messages)}
+    return {
+      "message_count": result["fetched"],
+      "inserted": result["inserted"],
+      "updated": result["updated"],
+    }
 
 
 @router.get("/folders")
@@ -109,8 +116,8 @@ async def get_folders(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(account_id, user.id, session)
-  return await service.get_folders(client)
+  async with account_client(account_id, user.id, session) as client:
+    return await service.get_folders(client)
 
 
 @router.post("/folder/add")
@@ -119,14 +126,14 @@ async def folder_add(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(params.account_id, user.id, session)
-  try:
-    await service.update_folder_chat(
-      client, params.folder_id, params.chat_id, remove=False
-    )
-  except ValueError as e:
-    raise HTTPException(status_code=404, detail=str(e))
-  return {"status": "success"}
+  async with account_client(params.account_id, user.id, session) as client:
+    try:
+      await service.update_folder_chat(
+        client, params.folder_id, params.chat_id, remove=False
+      )
+    except ValueError as e:
+      raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "success"}
 
 
 @router.post("/folder/remove")
@@ -135,14 +142,14 @@ async def folder_remove(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(params.account_id, user.id, session)
-  try:
-    await service.update_folder_chat(
-      client, params.folder_id, params.chat_id, remove=True
-    )
-  except ValueError as e:
-    raise HTTPException(status_code=404, detail=str(e))
-  return {"status": "success"}
+  async with account_client(params.account_id, user.id, session) as client:
+    try:
+      await service.update_folder_chat(
+        client, params.folder_id, params.chat_id, remove=True
+      )
+    except ValueError as e:
+      raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "success"}
 
 
 @router.post("/folder/bulk-add")
@@ -151,14 +158,14 @@ async def folder_bulk_add(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(params.account_id, user.id, session)
-  try:
-    await service.update_folder_chats(
-      client, params.folder_id, params.chat_ids, remove=False
-    )
-  except ValueError as e:
-    raise HTTPException(status_code=404, detail=str(e))
-  return {"status": "success"}
+  async with account_client(params.account_id, user.id, session) as client:
+    try:
+      await service.update_folder_chats(
+        client, params.folder_id, params.chat_ids, remove=False
+      )
+    except ValueError as e:
+      raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "success"}
 
 
 @router.post("/folder/bulk-remove")
@@ -167,14 +174,14 @@ async def folder_bulk_remove(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(params.account_id, user.id, session)
-  try:
-    await service.update_folder_chats(
-      client, params.folder_id, params.chat_ids, remove=True
-    )
-  except ValueError as e:
-    raise HTTPException(status_code=404, detail=str(e))
-  return {"status": "success"}
+  async with account_client(params.account_id, user.id, session) as client:
+    try:
+      await service.update_folder_chats(
+        client, params.folder_id, params.chat_ids, remove=True
+      )
+    except ValueError as e:
+      raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "success"}
 
 
 @router.post("/folder/create")
@@ -183,9 +190,9 @@ async def folder_create(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(params.account_id, user.id, session)
-  new_id = await service.create_folder(client, params.title, params.chat_id)
-  return {"id": new_id, "title": params.title}
+  async with account_client(params.account_id, user.id, session) as client:
+    new_id = await service.create_folder(client, params.title, params.chat_id)
+    return {"id": new_id, "title": params.title}
 
 
 @router.patch("/folder/rename")
@@ -194,12 +201,12 @@ async def folder_rename(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(params.account_id, user.id, session)
-  try:
-    await service.rename_folder(client, params.folder_id, params.title)
-  except ValueError as e:
-    raise HTTPException(status_code=404, detail=str(e))
-  return {"status": "success", "title": params.title}
+  async with account_client(params.account_id, user.id, session) as client:
+    try:
+      await service.rename_folder(client, params.folder_id, params.title)
+    except ValueError as e:
+      raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "success", "title": params.title}
 
 
 @router.delete("/folder/{folder_id}")
@@ -209,6 +216,6 @@ async def folder_delete(
   user: Annotated[User, Depends(get_current_user)],
   session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-  client = await get_account_client(account_id, user.id, session)
-  await service.delete_folder(client, folder_id)
-  return {"status": "success"}
+  async with account_client(account_id, user.id, session) as client:
+    await service.delete_folder(client, folder_id)
+    return {"status": "success"}
@@ -1,4 +1,5 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,13 +8,23 @@ from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 from shared.models import User, UserRole, get_async_session
+from telegram import client as tg_client, listener as tg_listener
 from .auth.security import create_access_token, verify_password, get_password_hash
 from .auth.sso import google_sso
 from .auth.deps import get_current_user
 from .api.v1.routers import api_router
 from typing import Annotated
 
-app = FastAPI(title="Manager Backend")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  await tg_listener.start_enabled_listeners()
+  yield
+  await tg_listener.stop_all_listeners()
+  await tg_client.pool.close()
+
+
+app = FastAPI(title="Manager Backend", lifespan=lifespan)
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts="*")
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000").rstrip("/")
@@ -1,7 +1,10 @@
-import asyncio
+import multiprocessing
+import os
+import socket
 import typer
 from shared.models import init_db
-from agents.agents import service
+from telegram.client import run_async
+from agents.agents import prefilter as prefilters, processor, service
 
 app = typer.Typer(name="agents")
 
@@ -18,11 +21,193 @@ def review(
   max_messages: int | None = typer.Option(
     None, "--max", help="Maximum messages to review"
   ),
+  concurrency: int = typer.Option(
+    service.DEFAULT_CONCURRENCY,
+    "--concurrency",
+    help="Model batches in flight at start, adapted to rate limits",
+  ),
+  max_concurrency: int = typer.Option(
+    service.MAX_CONCURRENCY,
+    "--max-concurrency",
+    help="Upper bound for model batches in flight",
+  ),
+  prefilter: str | None = typer.Option(
+    None,
+    "--prefilter",
+    help="Dismiss obvious non-vacancies locally first: rules or linear",
+  ),
+  stream: bool = typer.Option(
+    False, "--stream", help="Save reviews as the model finishes them"
+  ),
+  hedge: bool = typer.Option(
+    False, "--hedge", help="Duplicate requests slower than the usual p95"
+  ),
 ):
   """Main entry point for the review agent."""
-  processed_total = asyncio.run(
-    service.review_messages(
-      prompt_id=prompt_id, user_id=user_id, max_messages=max_messages
-    )
+  stats: list[processor.BatchStats] = []
+  processed_total = run_async(
+    service.review_messages,
+    prompt_id=prompt_id,
+    user_id=user_id,
+    max_messages=max_messages,
+    concurrency=concurrency,
+    max_concurrency=max_concurrency,
+    stats=stats,
+    prefilter=prefilters.get_prefilter(prefilter) if prefilter else None,
+    stream=stream,
+    hedge=hedge,
   )
   typer.echo(f"Done. Processed total: {processed_total} messages.")
+  for key, value in processor.summarize_stats(stats).items():
+    typer.echo(f"  {key}: {value}")
+
+
+@app.command()
+def enqueue(
+  prompt_id: int = typer.Option(..., "--prompt-id", help="Prompt ID to use"),
+  user_id: int = typer.Option(..., "--user-id", help="User ID owning the prompt"),
+  priority: int = typer.Option(0, "--priority", help="Higher is reviewed first"),
+  all_messages: bool = typer.Option(
+    False, "--all", help="Queue reviewed messages as well"
+  ),
+):
+  """Queue messages for review by workers."""
+  queued = service.enqueue_reviews(
+    prompt_id, user_id, priority=priority, unreviewed_only=not all_messages
+  )
+  typer.echo(f"Queued {queued} messages.")
+
+
+def _run_worker(index: int, options: dict) -> int:
+  owner = f"{socket.gethostname()}:{os.getpid()}:{index}"
+  prefilter = options.pop("prefilter")
+  return run_async(
+    service.run_worker,
+    owner,
+    prefilter=prefilters.get_prefilter(prefilter) if prefilter else None,
+    **options,
+  )
+
+
+@app.command()
+def worker(
+  processes: int = typer.Option(1, "--processes", help="Worker processes to run"),
+  prompt_id: int | None = typer.Option(
+    None, "--prompt-id", help="Only review items queued for this prompt"
+  ),
+  concurrency: int = typer.Option(
+    service.DEFAULT_CONCURRENCY,
+    "--concurrency",
+    help="Model batches in flight per process at start",
+  ),
+  max_concurrency: int = typer.Option(
+    service.MAX_CONCURRENCY,
+    "--max-concurrency",
+    help="Upper bound for model batches in flight per process",
+  ),
+  prefilter: str | None = typer.Option(
+    None,
+    "--prefilter",
+    help="Dismiss obvious non-vacancies locally first: rules or linear",
+  ),
+  follow: bool = typer.Option(
+    False, "--follow", help="Keep waiting for new items when the queue is empty"
+  ),
+  stream: bool = typer.Option(
+    False, "--stream", help="Save reviews as the model finishes them"
+  ),
+  hedge: bool = typer.Option(
+    False, "--hedge", help="Duplicate requests slower than the usual p95"
+  ),
+):
+  """Review queued messages, optionally in several processes."""
+  options = {
+    "prompt_id": prompt_id,
+    "concurrency": concurrency,
+    "max_concurrency": max_concurrency,
+    "prefilter": prefilter,
+    "follow": follow,
+    "stream": stream,
+    "hedge": hedge,
+  }
+  if processes <= 1:
+    processed_total = _run_worker(0, options)
+  else:
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+      processed_total = sum(
+        pool.starmap(_run_worker, [(i, dict(options)) for i in range(processes)])
+      )
+  typer.echo(f"Done. Processed total: {processed_total} messages.")
+
+
+@app.command()
+def migrate(
+  prompt_id: int = typer.Option(..., "--prompt-id", help="Prompt ID to use"),
+  user_id: int = typer.Option(..., "--user-id", help="User ID owning the prompt"),
+  version: int | None = typer.Option(
+    None, "--version", help="Target prompt version, the latest by default"
+  ),
+  concurrency: int = typer.Option(
+    service.MIGRATION_CONCURRENCY,
+    "--concurrency",
+    help="Model batches in flight",
+  ),
+  prefilter: str | None = typer.Option(
+    None,
+    "--prefilter",
+    help="Dismiss obvious non-vacancies locally first: rules or linear",
+  ),
+):
+  """Re-review messages reviewed by older versions of a prompt, newest first.
+
+  Run it again to resume an interrupted migration.
+  """
+  migration = service.start_review_migration(prompt_id, user_id, version)
+  typer.echo(
+    f"Migration {migration.id} to version {migration.prompt_version}: "
+    f"{migration.total} messages queued."
+  )
+  progress = run_async(
+    service.run_review_migration,
+    migration.id,
+    concurrency=concurrency,
+    prefilter=prefilters.get_prefilter(prefilter) if prefilter else None,
+  )
+  for key, value in progress.items():
+    typer.echo(f"  {key}: {value}")
+
+
+@app.command()
+def prefilter_train(
+  path: str = typer.Option(
+    prefilters.MODEL_PATH, "--path", help="Where to save the classifier"
+  ),
+  limit: int = typer.Option(50_000, "--limit", help="Past reviews to learn from"),
+  prompt_id: int | None = typer.Option(
+    None, "--prompt-id", help="Only learn from reviews by this prompt"
+  ),
+):
+  """Train the linear prefilter on past model decisions."""
+  report = service.train_prefilter(path, limit=limit, prompt_id=prompt_id)
+  typer.echo(f"Saved to {path}. Holdout evaluation:")
+  for key, value in report.items():
+    typer.echo(f"  {key}: {value}")
+
+
+@app.command()
+def prefilter_eval(
+  name: str = typer.Option("rules", "--prefilter", help="rules or linear"),
+  path: str = typer.Option(
+    prefilters.MODEL_PATH, "--path", help="Classifier of the linear prefilter"
+  ),
+  limit: int = typer.Option(10_000, "--limit", help="Past reviews to compare with"),
+  prompt_id: int | None = typer.Option(
+    None, "--prompt-id", help="Only compare with reviews by this prompt"
+  ),
+):
+  """Report precision and recall of a prefilter against past model decisions."""
+  report = service.evaluate_prefilter(
+    prefilters.get_prefilter(name, path), limit=limit, prompt_id=prompt_id
+  )
+  for key, value in report.items():
+    typer.echo(f"  {key}: {value}")
@@ -1,8 +1,8 @@
 import typer
 from datetime import datetime
 from telethon import types
-from telegram import service
-from telegram.client import run_async, get_client
+from telegram import fetcher, listener, service
+from telegram.client import pool, run_async, get_client
 from shared.models import TelegramAccount, session_context
 from sqlmodel import select
 
@@ -21,14 +21,17 @@ async def get_default_client():
     client = await get_client(
       account.api_id, account.api_hash, account.session_string, account.id
     )
-    if not client.is_connected():
-      await client.connect()
+    # A command may run for longer than the idle timeout, keep the client
+    # until run_async closes the pool
+    pool.pin(account.id)
     return client
 
 
 @app.command()
 def fetch(
-  new_only: bool = typer.Option(True, help="Fetch only unread messages"),
+  new_only: bool = typer.Option(
+    True, help="Fetch only messages newer than the last fetch"
+  ),
   date_from: datetime | None = typer.Option(
     None, help="Parse messages after this date"
   ),
@@ -36,23 +39,39 @@ def fetch(
   max_messages: int = typer.Option(1000, help="Maximum messages per chat"),
   folder_id: int | None = typer.Option(None, help="Folder ID to sync"),
   dry_run: bool = typer.Option(False, "--dry-run", help="Dry run mode"),
+  concurrency: int = typer.Option(
+    fetcher.DEFAULT_CONCURRENCY, help="Number of chats fetched at once"
+  ),
 ):
   """Fetch all dialogs and messages from Telegram and save to database"""
 
   async def run():
     client = await get_default_client()
-    dialogs = await service.sync_dialogs(client, folder_id=folder_id, dry_run=dry_run)
-    for dialog in dialogs:
-      typer.echo(f"Processing chat: {dialog.name} (ID: {dialog.id})")
-      messages = await service.get_messages(
-        client, dialog, new_only, max_messages, date_from, date_to, dry_run=dry_run
+    dialogs = service.iter_synced_dialogs(client, folder_id=folder_id, dry_run=dry_run)
+    async for report, result in fetcher.iter_fetch_dialogs(
+      client,
+      dialogs,
+      new_only,
+      max_messages,
+      date_from,
+      date_to,
+      dry_run=dry_run,
+      concurrency=concurrency,
+    ):
+      typer.echo(
+        f"Processed chat: {report['chat_name']} (ID: {report['chat_id']}) "
+        f"in {report['elapsed']:.1f}s"
       )
-      if messages:
-        typer.echo(f"  ✓ Found {len(messages)} messages")
-        if dry_run:
-          for msg in messages:
-            text = (msg.message or "").replace("\n", " ")
-            typer.echo(f"    [{msg.date}] {msg.id}: {text[:100]}")
+      if report["error"]:
+        typer.echo(f"  ✗ {report['error']}")
+      elif report["message_count"]:
+        typer.echo(
+          f"  ✓ Found {report['message_count']} messages "
+          f"({report['inserted']} new, {report['updated']} updated)"
+        )
+        for msg in result.get("messages", []):
+          text = (msg["text"] or "").replace("\n", " ")
+          typer.echo(f"    [{msg['date']}] {msg['telegram_id']}: {text[:100]}")
       else:
         typer.echo("  No new messages")
 
@@ -68,8 +87,9 @@ def fetch_chats(
 
   async def run():
     client = await get_default_client()
-    dialogs = await service.sync_dialogs(client, folder_id=folder_id, dry_run=dry_run)
-    for d in dialogs:
+    async for d in service.iter_synced_dialogs(
+      client, folder_id=folder_id, dry_run=dry_run
+    ):
       typer.echo(f"Chat: {d.name} (ID: {d.id})")
 
   run_async(run)
@@ -78,7 +98,9 @@ def fetch_chats(
 @app.command()
 def fetch_messages(
   chat_id: int = typer.Argument(..., help="Chat ID to parse messages from"),
-  new_only: bool = typer.Option(True, help="Fetch only unread messages"),
+  new_only: bool = typer.Option(
+    True, help="Fetch only messages newer than the last fetch"
+  ),
   date_from: datetime | None = typer.Option(
     None, help="Parse messages after this date"
   ),
@@ -90,12 +112,16 @@ def fetch_messages(
 
   async def run():
     client = await get_default_client()
-    messages = await service.get_messages(
+    result = await service.get_messages(
       client, chat_id, new_only, max_messages, date_from, date_to, dry_run=dry_run
     )
-    for msg in messages:
-      text = (msg.message or "").replace("\n", " ")
-      typer.echo(f"[{msg.date}] {msg.id}: {text[:50]}...")
+    for msg in result.get("messages", []):
+      text = (msg["text"] or "").replace("\n", " ")
+      typer.echo(f"[{msg['date']}] {msg['telegram_id']}: {text[:50]}...")
+    typer.echo(
+      f"Fetched {result['fetched']} messages "
+      f"({result['inserted']} new, {result['updated']} updated)"
+    )
 
   run_async(run)
 
@@ -179,3 +205,19 @@ def folder_delete(
 
   run_async(run)
   typer.echo(f"✓ Folder with ID {folder_id} deleted successfully")
+
+
+@app.command()
+def listen():
+  """Ingest new and edited messages in real time until interrupted"""
+
+  async def run():
+    client = await get_default_client()
+    await listener.start_listener(client, client.account_id)
+    typer.echo("Listening for new messages, press Ctrl+C to stop")
+    try:
+      await client.run_until_disconnected()
+    finally:
+      await listener.stop_listener(client.account_id)
+
+  run_async(run)
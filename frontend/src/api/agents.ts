@@ -1,7 +1,21 @@
 import { api } from './http'
-import type { AgentReviewRequest } from './types'
+import type {
+  AgentReviewRequest,
+  ReviewMigration,
+  ReviewMigrationRequest,
+} from './types'
 
 export async function runAgentReview(data: AgentReviewRequest): Promise<void> {
   return api.post('/agents/review', data)
 }
 
+export async function startReviewMigration(
+  data: ReviewMigrationRequest,
+): Promise<ReviewMigration> {
+  return api.post('/agents/migrations', data)
+}
+
+export async function getReviewMigration(id: number): Promise<ReviewMigration> {
+  return api.get(`/agents/migrations/${id}`)
+}
+
@@ -73,6 +73,7 @@ export interface TelegramAccount {
   phone: string
   name?: string
   username?: string
+  listen_updates?: boolean
 }
 
 export interface TelegramAccountCreate {
@@ -89,6 +90,7 @@ export interface TelegramAccountConfirm {
 export interface TelegramAccountUpdate {
   name?: string
   username?: string
+  listen_updates?: boolean
 }
 
 // Folder
@@ -176,6 +178,7 @@ export interface VacancyReview {
   account_username?: string
   prompt_id?: number
   prompt_version?: number
+  is_stale?: boolean
 }
 
 export interface VacancyReviewCreate {
@@ -232,6 +235,7 @@ export interface TelegramFetchRequest {
   max_messages?: number
   folder_id?: number
   dry_run?: boolean
+  concurrency?: number
 }
 
 export interface TelegramFetchChatsRequest {
@@ -288,6 +292,27 @@ export interface AgentReviewRequest {
   account_id?: number
   chat_id?: number
   folder_id?: number
+  concurrency?: number
+  prefilter?: 'rules' | 'linear'
+  stream?: boolean
+  hedge?: boolean
+}
+
+export interface ReviewMigrationRequest {
+  prompt_id: number
+  prompt_version?: number
+  concurrency?: number
+}
+
+export interface ReviewMigration {
+  id: number
+  prompt_id: number
+  prompt_version: number
+  status: 'RUNNING' | 'DONE'
+  total: number
+  remaining: number
+  created_at: string
+  finished_at: string | null
 }
 
 // API Error
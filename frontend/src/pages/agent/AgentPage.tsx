@@ -472,7 +472,7 @@ export function AgentPage() {
                         <label className="flex items-center justify-between cursor-pointer group">
                           <div className="space-y-0.5">
                             <span className="text-xs font-black uppercase text-[var(--color-text-primary)]">New Messages Only</span>
-                            <p className="text-[10px] text-[var(--color-text-muted)] font-bold uppercase tracking-tighter">Only fetch unread messages from Telegram</p>
+                            <p className="text-[10px] text-[var(--color-text-muted)] font-bold uppercase tracking-tighter">Only fetch messages newer than the last fetch</p>
                           </div>
                           <div 
                             onClick={() => setNewOnly(!newOnly)}
@@ -0,0 +1,62 @@
+"""add review queue
+
+Revision ID: 2d7f5a9e8b14
+Revises: 9c4d1e6b3a52
+Create Date: 2026-10-17 17:22:39.604218
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "2d7f5a9e8b14"
+down_revision: Union[str, Sequence[str], None] = "9c4d1e6b3a52"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+  """Upgrade schema."""
+  op.create_table(
+    "reviewqueueitem",
+    sa.Column("id", sa.Integer(), nullable=False),
+    sa.Column("message_id", sa.Integer(), nullable=False),
+    sa.Column("prompt_id", sa.Integer(), nullable=False),
+    sa.Column("prompt_version", sa.Integer(), nullable=False),
+    sa.Column("priority", sa.Integer(), nullable=False),
+    sa.Column("lease_owner", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column("lease_expires_at", sa.DateTime(), nullable=True),
+    sa.Column("attempts", sa.Integer(), nullable=False),
+    sa.Column("enqueued_at", sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(["message_id"], ["message.id"]),
+    sa.PrimaryKeyConstraint("id"),
+    sa.UniqueConstraint(
+      "message_id", "prompt_id", name="uq_reviewqueueitem_message_id_prompt_id"
+    ),
+  )
+  with op.batch_alter_table("reviewqueueitem", schema=None) as batch_op:
+    batch_op.create_index(
+      batch_op.f("ix_reviewqueueitem_message_id"), ["message_id"], unique=False
+    )
+    batch_op.create_index(
+      batch_op.f("ix_reviewqueueitem_priority"), ["priority"], unique=False
+    )
+    batch_op.create_index(
+      batch_op.f("ix_reviewqueueitem_lease_expires_at"),
+      ["lease_expires_at"],
+      unique=False,
+    )
+
+
+def downgrade() -> None:
+  """Downgrade schema."""
+  with op.batch_alter_table("reviewqueueitem", schema=None) as batch_op:
+    batch_op.drop_index(batch_op.f("ix_reviewqueueitem_lease_expires_at"))
+    batch_op.drop_index(batch_op.f("ix_reviewqueueitem_priority"))
+    batch_op.drop_index(batch_op.f("ix_reviewqueueitem_message_id"))
+  op.drop_table("reviewqueueitem")
@@ -0,0 +1,39 @@
+"""add dialog fetch cursor
+
+Revision ID: 3a1c9e7f2b64
+Revises: bca40a59e473
+Create Date: 2026-10-17 10:12:31.204518
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3a1c9e7f2b64"
+down_revision: Union[str, Sequence[str], None] = "bca40a59e473"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+  """Upgrade schema."""
+  with op.batch_alter_table("dialog", schema=None) as batch_op:
+    batch_op.add_column(sa.Column("last_message_id", sa.Integer(), nullable=True))
+    batch_op.add_column(sa.Column("last_synced_at", sa.DateTime(), nullable=True))
+
+  # Seed cursors from already ingested messages
+  op.execute(
+    "UPDATE dialog SET last_message_id = "
+    "(SELECT MAX(message.telegram_id) FROM message WHERE message.dialog_id = dialog.id)"
+  )
+
+
+def downgrade() -> None:
+  """Downgrade schema."""
+  with op.batch_alter_table("dialog", schema=None) as batch_op:
+    batch_op.drop_column("last_synced_at")
+    batch_op.drop_column("last_message_id")
@@ -0,0 +1,65 @@
+"""add message text hash
+
+Revision ID: 4b9e2d7c6f18
+Revises: c5f81d3a9e27
+Create Date: 2026-10-17 13:41:26.905114
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+from shared.text import text_hash
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4b9e2d7c6f18"
+down_revision: Union[str, Sequence[str], None] = "c5f81d3a9e27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def upgrade() -> None:
+  """Upgrade schema."""
+  with op.batch_alter_table("message", schema=None) as batch_op:
+    batch_op.add_column(
+      sa.Column("text_hash", sqlmodel.sql.sqltypes.AutoString(), nullable=True)
+    )
+    batch_op.create_index(
+      batch_op.f("ix_message_text_hash"), ["text_hash"], unique=False
+    )
+
+  # Hash already ingested messages, walking them in id order
+  connection = op.get_bind()
+  message = sa.table(
+    "message", sa.column("id"), sa.column("text"), sa.column("text_hash")
+  )
+  last_id = 0
+  while True:
+    rows = connection.execute(
+      sa.select(message.c.id, message.c.text)
+      .where(message.c.id > last_id, message.c.text.is_not(None))
+      .order_by(message.c.id)
+      .limit(BACKFILL_CHUNK_SIZE)
+    ).all()
+    if not rows:
+      break
+    connection.execute(
+      message.update()
+      .where(message.c.id == sa.bindparam("message_id"))
+      .values(text_hash=sa.bindparam("hash")),
+      [{"message_id": row.id, "hash": text_hash(row.text)} for row in rows],
+    )
+    last_id = rows[-1].id
+
+
+def downgrade() -> None:
+  """Downgrade schema."""
+  with op.batch_alter_table("message", schema=None) as batch_op:
+    batch_op.drop_index(batch_op.f("ix_message_text_hash"))
+    batch_op.drop_column("text_hash")
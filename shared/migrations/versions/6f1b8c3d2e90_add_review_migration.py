@@ -0,0 +1,49 @@
+"""add review migration
+
+Revision ID: 6f1b8c3d2e90
+Revises: 2d7f5a9e8b14
+Create Date: 2026-10-17 19:05:12.118402
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "6f1b8c3d2e90"
+down_revision: Union[str, Sequence[str], None] = "2d7f5a9e8b14"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+  """Upgrade schema."""
+  op.create_table(
+    "reviewmigration",
+    sa.Column("id", sa.Integer(), nullable=False),
+    sa.Column("prompt_id", sa.Integer(), nullable=False),
+    sa.Column("prompt_version", sa.Integer(), nullable=False),
+    sa.Column(
+      "status",
+      sa.Enum("RUNNING", "DONE", name="reviewmigrationstatus"),
+      nullable=False,
+    ),
+    sa.Column("total", sa.Integer(), nullable=False),
+    sa.Column("created_at", sa.DateTime(), nullable=False),
+    sa.Column("finished_at", sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint("id"),
+  )
+  with op.batch_alter_table("reviewmigration", schema=None) as batch_op:
+    batch_op.create_index(
+      batch_op.f("ix_reviewmigration_prompt_id"), ["prompt_id"], unique=False
+    )
+
+
+def downgrade() -> None:
+  """Downgrade schema."""
+  with op.batch_alter_table("reviewmigration", schema=None) as batch_op:
+    batch_op.drop_index(batch_op.f("ix_reviewmigration_prompt_id"))
+  op.drop_table("reviewmigration")
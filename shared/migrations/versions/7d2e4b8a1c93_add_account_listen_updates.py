@@ -0,0 +1,33 @@
+"""add account listen updates
+
+Revision ID: 7d2e4b8a1c93
+Revises: 3a1c9e7f2b64
+Create Date: 2026-10-17 11:02:47.881342
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7d2e4b8a1c93"
+down_revision: Union[str, Sequence[str], None] = "3a1c9e7f2b64"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+  """Upgrade schema."""
+  with op.batch_alter_table("telegramaccount", schema=None) as batch_op:
+    batch_op.add_column(
+      sa.Column("listen_updates", sa.Boolean(), server_default="0", nullable=False)
+    )
+
+
+def downgrade() -> None:
+  """Downgrade schema."""
+  with op.batch_alter_table("telegramaccount", schema=None) as batch_op:
+    batch_op.drop_column("listen_updates")
@@ -0,0 +1,34 @@
+"""add review reviewed by
+
+Revision ID: 9c4d1e6b3a52
+Revises: e8a3f6c1d245
+Create Date: 2026-10-17 16:08:44.172935
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9c4d1e6b3a52"
+down_revision: Union[str, Sequence[str], None] = "e8a3f6c1d245"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+  """Upgrade schema."""
+  with op.batch_alter_table("vacancyreview", schema=None) as batch_op:
+    batch_op.add_column(
+      sa.Column("reviewed_by", sqlmodel.sql.sqltypes.AutoString(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+  """Downgrade schema."""
+  with op.batch_alter_table("vacancyreview", schema=None) as batch_op:
+    batch_op.drop_column("reviewed_by")
@@ -0,0 +1,33 @@
+"""add review is stale
+
+Revision ID: a4e7c2f9d031
+Revises: 6f1b8c3d2e90
+Create Date: 2026-10-17 20:41:37.502914
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a4e7c2f9d031"
+down_revision: Union[str, Sequence[str], None] = "6f1b8c3d2e90"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+  """Upgrade schema."""
+  with op.batch_alter_table("vacancyreview", schema=None) as batch_op:
+    batch_op.add_column(
+      sa.Column("is_stale", sa.Boolean(), nullable=False, server_default=sa.false())
+    )
+
+
+def downgrade() -> None:
+  """Downgrade schema."""
+  with op.batch_alter_table("vacancyreview", schema=None) as batch_op:
+    batch_op.drop_column("is_stale")
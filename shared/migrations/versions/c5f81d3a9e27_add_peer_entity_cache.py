@@ -0,0 +1,52 @@
+"""add peer entity cache
+
+Revision ID: c5f81d3a9e27
+Revises: 7d2e4b8a1c93
+Create Date: 2026-10-17 12:18:05.412977
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c5f81d3a9e27"
+down_revision: Union[str, Sequence[str], None] = "7d2e4b8a1c93"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+  """Upgrade schema."""
+  op.create_table(
+    "peerentity",
+    sa.Column("account_id", sa.Integer(), nullable=False),
+    sa.Column("peer_id", sa.Integer(), nullable=False),
+    sa.Column("access_hash", sa.Integer(), nullable=False),
+    sa.Column(
+      "peer_type",
+      sa.Enum("USER", "CHAT", "CHANNEL", name="peertype"),
+      nullable=False,
+    ),
+    sa.Column("username", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column("phone", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column("name", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column("updated_at", sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(["account_id"], ["telegramaccount.id"]),
+    sa.PrimaryKeyConstraint("account_id", "peer_id"),
+  )
+  with op.batch_alter_table("peerentity", schema=None) as batch_op:
+    batch_op.create_index(
+      batch_op.f("ix_peerentity_username"), ["username"], unique=False
+    )
+
+
+def downgrade() -> None:
+  """Downgrade schema."""
+  with op.batch_alter_table("peerentity", schema=None) as batch_op:
+    batch_op.drop_index(batch_op.f("ix_peerentity_username"))
+  op.drop_table("peerentity")
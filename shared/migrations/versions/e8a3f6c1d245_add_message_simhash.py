@@ -0,0 +1,82 @@
+"""add message simhash
+
+Revision ID: e8a3f6c1d245
+Revises: 4b9e2d7c6f18
+Create Date: 2026-10-17 14:56:12.338470
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from shared.text import SIMHASH_BANDS, text_fingerprints
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e8a3f6c1d245"
+down_revision: Union[str, Sequence[str], None] = "4b9e2d7c6f18"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_CHUNK_SIZE = 1000
+BAND_COLUMNS = [f"simhash_band_{band}" for band in range(SIMHASH_BANDS)]
+
+
+def upgrade() -> None:
+  """Upgrade schema."""
+  with op.batch_alter_table("message", schema=None) as batch_op:
+    batch_op.add_column(sa.Column("simhash", sa.Integer(), nullable=True))
+    for column in BAND_COLUMNS:
+      batch_op.add_column(sa.Column(column, sa.Integer(), nullable=True))
+      batch_op.create_index(batch_op.f(f"ix_message_{column}"), [column], unique=False)
+
+  # Fingerprint already ingested messages, walking them in id order
+  connection = op.get_bind()
+  message = sa.table(
+    "message",
+    sa.column("id"),
+    sa.column("text"),
+    sa.column("simhash"),
+    *(sa.column(column) for column in BAND_COLUMNS),
+  )
+  last_id = 0
+  while True:
+    rows = connection.execute(
+      sa.select(message.c.id, message.c.text)
+      .where(message.c.id > last_id, message.c.text.is_not(None))
+      .order_by(message.c.id)
+      .limit(BACKFILL_CHUNK_SIZE)
+    ).all()
+    if not rows:
+      break
+    values = []
+    for row in rows:
+      fingerprints = text_fingerprints(row.text)
+      values.append(
+        {
+          "message_id": row.id,
+          "b_simhash": fingerprints["simhash"],
+          **{f"b_{column}": fingerprints[column] for column in BAND_COLUMNS},
+        }
+      )
+    connection.execute(
+      message.update()
+      .where(message.c.id == sa.bindparam("message_id"))
+      .values(
+        simhash=sa.bindparam("b_simhash"),
+        **{column: sa.bindparam(f"b_{column}") for column in BAND_COLUMNS},
+      ),
+      values,
+    )
+    last_id = rows[-1].id
+
+
+def downgrade() -> None:
+  """Downgrade schema."""
+  with op.batch_alter_table("message", schema=None) as batch_op:
+    for column in BAND_COLUMNS:
+      batch_op.drop_index(batch_op.f(f"ix_message_{column}"))
+      batch_op.drop_column(column)
+    batch_op.drop_column("simhash")
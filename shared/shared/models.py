@@ -2,13 +2,14 @@ import os
 import json
 import contextlib
 from enum import Enum
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Generator, AsyncGenerator
 
 from pydantic import BaseModel, ConfigDict, Field as PydanticField
 from sqlmodel import SQLModel, Field, Relationship, create_engine, Session, Column
 from sqlalchemy import JSON, event, UniqueConstraint
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from .text import hamming_distance
 
 
 # Database configuration
@@ -19,6 +20,11 @@ DB_URL = f"sqlite:///{DB_PATH}"
 ASYNC_DB_URL = f"sqlite+aiosqlite:///{DB_PATH}"
 
 
+def utc_now() -> datetime:
+  """Current time in UTC, timezone-aware, for timestamps compared in queries."""
+  return datetime.now(timezone.utc)
+
+
 def pydantic_encoder(obj):
   if hasattr(obj, "model_dump"):
     return obj.model_dump(by_alias=True)
@@ -46,6 +52,14 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
   cursor.execute("PRAGMA journal_mode=WAL")
   cursor.execute("PRAGMA synchronous=NORMAL")
   cursor.close()
+  # Lets near-duplicate lookups drop SimHash band collisions in the query
+  dbapi_connection.create_function(
+    "hamming_distance", 2, _sql_hamming_distance, deterministic=True
+  )
+
+
+def _sql_hamming_distance(a: int | None, b: int | None) -> int | None:
+  return None if a is None or b is None else hamming_distance(a, b)
 
 
 @event.listens_for(async_engine.sync_engine, "connect")
@@ -125,6 +139,8 @@ class TelegramAccount(SQLModel, table=True):
   name: str | None = None
   username: str | None = None
   session_string: str | None = None
+  # Opt-in real-time ingestion from Telegram update events
+  listen_updates: bool = Field(default=False)
 
   user: User = Relationship(back_populates="accounts")
   dialogs: list["Dialog"] = Relationship(back_populates="account")
@@ -153,6 +169,9 @@ class Dialog(SQLModel, table=True):
   entity_type: DialogType
   username: str | None = Field(default=None, index=True)
   name: str | None = Field(default=None, index=True)
+  # High-watermark of ingested messages, used for incremental fetching
+  last_message_id: int | None = None
+  last_synced_at: datetime | None = None
 
   account: TelegramAccount = Relationship(back_populates="dialogs")
   folders: list[Folder] = Relationship(
@@ -176,6 +195,14 @@ class Message(SQLModel, table=True):
   from_id: int | None = None
   from_type: PeerType | None = None
   text: str | None = None
+  # Hash of the normalized text, shared by reposts of the same post
+  text_hash: str | None = Field(default=None, index=True)
+  # SimHash of the text and its 16-bit bands, for near-duplicate lookups
+  simhash: int | None = None
+  simhash_band_0: int | None = Field(default=None, index=True)
+  simhash_band_1: int | None = Field(default=None, index=True)
+  simhash_band_2: int | None = Field(default=None, index=True)
+  simhash_band_3: int | None = Field(default=None, index=True)
   date: datetime | None = None
 
   dialog: Dialog = Relationship(back_populates="messages")
@@ -187,6 +214,19 @@ class Message(SQLModel, table=True):
   __table_args__ = (UniqueConstraint("telegram_id", "dialog_id"),)
 
 
+# Peer access data cached per account, so StringSession clients can resolve
+# peers without network round trips after a restart
+class PeerEntity(SQLModel, table=True):
+  account_id: int = Field(foreign_key="telegramaccount.id", primary_key=True)
+  peer_id: int = Field(primary_key=True)
+  access_hash: int
+  peer_type: PeerType
+  username: str | None = Field(default=None, index=True)
+  phone: str | None = None
+  name: str | None = None
+  updated_at: datetime = Field(default_factory=utc_now)
+
+
 class ContactType(EnumCat):
   PHONE = "PHONE"
   EMAIL = "EMAIL"
@@ -243,6 +283,10 @@ class VacancyReview(SQLModel, table=True):
   salary_fork_to: int | None = None
   prompt_id: int | None = Field(default=None)
   prompt_version: int | None = Field(default=None)
+  # Local prefilter that decided instead of the model, None for model reviews
+  reviewed_by: str | None = None
+  # The message was edited after this review, it waits for a new one
+  is_stale: bool = False
 
   message: Message = Relationship(back_populates="review")
   vacancy: "VacancyProgress" = Relationship(
@@ -251,6 +295,44 @@ class VacancyReview(SQLModel, table=True):
   )
 
 
+# Message awaiting review by a prompt version. Workers lease items before
+# reviewing them and delete them once the review is saved. A message is
+# queued at most once per prompt, for a single version of it
+class ReviewQueueItem(SQLModel, table=True):
+  id: int | None = Field(default=None, primary_key=True)
+  message_id: int = Field(foreign_key="message.id", index=True)
+  prompt_id: int
+  prompt_version: int
+  priority: int = Field(default=0, index=True)
+  lease_owner: str | None = None
+  lease_expires_at: datetime | None = Field(default=None, index=True)
+  attempts: int = 0
+  enqueued_at: datetime = Field(default_factory=utc_now)
+
+  __table_args__ = (
+    UniqueConstraint(
+      "message_id", "prompt_id", name="uq_reviewqueueitem_message_id_prompt_id"
+    ),
+  )
+
+
+class ReviewMigrationStatus(EnumCat):
+  RUNNING = "RUNNING"
+  DONE = "DONE"
+
+
+# Job that re-reviews messages reviewed by older versions of a prompt. Its
+# messages wait in the review queue, so an interrupted job resumes from there
+class ReviewMigration(SQLModel, table=True):
+  id: int | None = Field(default=None, primary_key=True)
+  prompt_id: int = Field(index=True)
+  prompt_version: int
+  status: ReviewMigrationStatus = Field(default=ReviewMigrationStatus.RUNNING)
+  total: int = 0
+  created_at: datetime = Field(default_factory=utc_now)
+  finished_at: datetime | None = None
+
+
 class VacancyProgressStatus(EnumCat):
   NEW = "NEW"
   CONTACT = "CONTACT"
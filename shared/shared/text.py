@@ -0,0 +1,91 @@
+import hashlib
+import re
+import unicodedata
+
+_INVISIBLE = re.compile("[\u200b-\u200f\u2060\ufeff]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+  """Canonical form of a message text, so reposts of a post compare equal.
+
+  Unicode compatibility forms are folded, case and invisible characters are
+  dropped and whitespace runs collapse to a single space.
+  """
+  text = unicodedata.normalize("NFKC", text)
+  text = _INVISIBLE.sub("", text).casefold()
+  return _WHITESPACE.sub(" ", text).strip()
+
+
+def text_hash(text: str | None) -> str | None:
+  """Hash of the normalized text, None for messages without text."""
+  if not text:
+    return None
+  normalized = normalize_text(text)
+  if not normalized:
+    return None
+  return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+
+# SimHash parameters: 64-bit fingerprints split into bands of 16 bits. Texts
+# within SIMHASH_MAX_DISTANCE bits share at least one band (pigeonhole), so
+# an index lookup per band finds all of them.
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+SIMHASH_MAX_DISTANCE = 3
+_BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+_MASK = (1 << SIMHASH_BITS) - 1
+
+_HASHTAG = re.compile(r"#\w+")
+_URL = re.compile(r"https?://\S+|t\.me/\S+")
+_WORD = re.compile(r"\w+")
+
+
+def simhash(text: str | None) -> int | None:
+  """64-bit SimHash over the words of a text, as a signed SQLite integer.
+
+  Hashtags, links, emoji and punctuation are ignored, so reposts that only
+  differ in those or in a contact line land within a few bits of each other.
+  """
+  if not text:
+    return None
+  text = _URL.sub(" ", _HASHTAG.sub(" ", normalize_text(text)))
+  words = _WORD.findall(text)
+  if not words:
+    return None
+
+  weights = [0] * SIMHASH_BITS
+  for word in words:
+    value = int.from_bytes(
+      hashlib.blake2b(word.encode(), digest_size=8).digest(), "big"
+    )
+    for bit in range(SIMHASH_BITS):
+      weights[bit] += 1 if value >> bit & 1 else -1
+  fingerprint = sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+  return fingerprint - (1 << SIMHASH_BITS) if fingerprint >> 63 else fingerprint
+
+
+def simhash_bands(fingerprint: int) -> list[int]:
+  fingerprint &= _MASK
+  return [
+    fingerprint >> (band * _BAND_BITS) & ((1 << _BAND_BITS) - 1)
+    for band in range(SIMHASH_BANDS)
+  ]
+
+
+def hamming_distance(a: int, b: int) -> int:
+  return ((a ^ b) & _MASK).bit_count()
+
+
+def text_fingerprints(text: str | None) -> dict:
+  """Exact and near-duplicate fingerprints of a text, as `Message` columns."""
+  fingerprint = simhash(text)
+  bands = simhash_bands(fingerprint) if fingerprint is not None else []
+  return {
+    "text_hash": text_hash(text),
+    "simhash": fingerprint,
+    **{
+      f"simhash_band_{band}": bands[band] if bands else None
+      for band in range(SIMHASH_BANDS)
+    },
+  }
@@ -0,0 +1,71 @@
+import time
+from telethon import functions
+
+# Seconds cached dialog filters and dialog lists stay valid
+METADATA_TTL = 5 * 60
+
+
+class MetadataCache:
+  """Per-account TTL cache for Telegram metadata (dialog filters, dialogs).
+
+  Entries are keyed by (account_id, kind). Our own folder mutations
+  invalidate the filters explicitly, the TTL covers changes made from
+  other Telegram apps.
+  """
+
+  def __init__(self, ttl: float = METADATA_TTL):
+    self.ttl = ttl
+    self._entries: dict[tuple[int, str], tuple[float, object]] = {}
+
+  def get(self, account_id: int, kind: str):
+    entry = self._entries.get((account_id, kind))
+    if entry is None:
+      return None
+    stored_at, value = entry
+    if time.monotonic() - stored_at > self.ttl:
+      del self._entries[(account_id, kind)]
+      return None
+    return value
+
+  def set(self, account_id: int, kind: str, value) -> None:
+    self._entries[(account_id, kind)] = (time.monotonic(), value)
+
+  def invalidate(self, account_id: int, kind: str | None = None) -> None:
+    for key in list(self._entries):
+      if key[0] == account_id and (kind is None or key[1] == kind):
+        del self._entries[key]
+
+
+metadata = MetadataCache()
+
+
+async def _cached(client, kind: str, load):
+  account_id = getattr(client, "account_id", None)
+  if account_id is None:
+    return await load()
+  value = metadata.get(account_id, kind)
+  if value is None:
+    value = await load()
+    metadata.set(account_id, kind, value)
+  return value
+
+
+async def get_dialog_filters(client) -> list:
+  """Dialog filters (folders) of the account, served from cache when fresh."""
+
+  async def load():
+    response = await client(functions.messages.GetDialogFiltersRequest())
+    return list(response.filters)
+
+  return await _cached(client, "filters", load)
+
+
+async def get_dialogs(client) -> list:
+  """Full dialog list of the account, served from cache when fresh."""
+  return await _cached(client, "dialogs", lambda: client.get_dialogs(limit=None))
+
+
+def invalidate_dialog_filters(client) -> None:
+  account_id = getattr(client, "account_id", None)
+  if account_id is not None:
+    metadata.invalidate(account_id, "filters")
@@ -1,12 +1,206 @@
 import asyncio
-from telethon import TelegramClient
+import random
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from telethon import TelegramClient, functions
 from telethon.sessions import StringSession
+from .session import DbSession
 
-# Registry for pending logins: {phone: (code_future, result_future, client)}
-_pending_logins: dict[str, tuple[asyncio.Future, asyncio.Future, TelegramClient]] = {}
+# Pooled clients idle for longer than this are disconnected
+IDLE_TIMEOUT = 15 * 60
+# Upper bound of connected pooled clients, least recently used go first
+MAX_CLIENTS = 32
+# Seconds between liveness pings and idle/expiry sweeps
+PING_INTERVAL = 60
+PING_TIMEOUT = 10
+# Logins whose code never arrives are dropped after this many seconds
+PENDING_LOGIN_TTL = 10 * 60
 
-# Keep track of active clients: {account_id: TelegramClient}
-_active_clients: dict[int, TelegramClient] = {}
+# Registry for pending logins: {phone: (code_future, result_future, client, started_at)}
+_pending_logins: dict[
+  str, tuple[asyncio.Future, asyncio.Future, TelegramClient, float]
+] = {}
+
+
+class ClientPool:
+  """Connected TelegramClient per account, shared by all callers.
+
+  Clients are kept in LRU order and disconnected once idle for
+  `idle_timeout` or when the pool outgrows `max_size`. Concurrent requests
+  for one account share a single connection attempt. A background task
+  pings live clients and drops the ones that stopped answering, so the
+  next request reconnects instead of failing. Leased clients (see `lease`)
+  and pinned ones (e.g. with an update listener attached) are never evicted.
+  """
+
+  def __init__(self, max_size: int = MAX_CLIENTS, idle_timeout: float = IDLE_TIMEOUT):
+    self.max_size = max_size
+    self.idle_timeout = idle_timeout
+    self._clients: OrderedDict[int, TelegramClient] = OrderedDict()
+    self._last_used: dict[int, float] = {}
+    self._connecting: dict[int, asyncio.Task] = {}
+    self._pinned: set[int] = set()
+    self._leases: dict[int, int] = {}
+    self._maintenance: asyncio.Task | None = None
+    self._hits = 0
+    self._misses = 0
+    self._evictions = 0
+    self._connect_count = 0
+    self._connect_seconds = 0.0
+
+  async def acquire(
+    self, api_id: int, api_hash: str, session_string: str | None, account_id: int
+  ) -> TelegramClient:
+    """Return a connected client for the account, connecting at most once."""
+    self._ensure_maintenance()
+    client = self._clients.get(account_id)
+    if client is not None and client.is_connected():
+      self._hits += 1
+      self._touch(account_id)
+      return client
+
+    self._misses += 1
+    task = self._connecting.get(account_id)
+    if task is None:
+      task = asyncio.create_task(
+        self._connect(api_id, api_hash, session_string, account_id)
+      )
+      self._connecting[account_id] = task
+      task.add_done_callback(lambda _: self._connecting.pop(account_id, None))
+    # A cancelled caller must not abort the attempt other callers wait on
+    return await asyncio.shield(task)
+
+  @asynccontextmanager
+  async def lease(
+    self, api_id: int, api_hash: str, session_string: str | None, account_id: int
+  ):
+    """Connected client that is not evicted until the block exits.
+
+    The idle timer starts again on exit, so long fetches or reviews do not
+    count as idle time.
+    """
+    client = await self.acquire(api_id, api_hash, session_string, account_id)
+    self._leases[account_id] = self._leases.get(account_id, 0) + 1
+    try:
+      yield client
+    finally:
+      self._leases[account_id] -= 1
+      if not self._leases[account_id]:
+        del self._leases[account_id]
+      if account_id in self._clients:
+        self._touch(account_id)
+
+  def pin(self, account_id: int) -> None:
+    self._pinned.add(account_id)
+
+  def unpin(self, account_id: int) -> None:
+    self._pinned.discard(account_id)
+
+  def stats(self) -> dict:
+    requests = self._hits + self._misses
+    return {
+      "open_clients": sum(1 for c in self._clients.values() if c.is_connected()),
+      "pooled_clients": len(self._clients),
+      "pinned_clients": len(self._pinned),
+      "leased_clients": len(self._leases),
+      "hits": self._hits,
+      "misses": self._misses,
+      "reuse_ratio": round(self._hits / requests, 3) if requests else 0.0,
+      "connects": self._connect_count,
+      "avg_connect_latency": round(self._connect_seconds / self._connect_count, 3)
+      if self._connect_count
+      else 0.0,
+      "evictions": self._evictions,
+      "pending_logins": len(_pending_logins),
+    }
+
+  async def close(self) -> None:
+    """Disconnect every pooled client and stop the maintenance task."""
+    if self._maintenance:
+      self._maintenance.cancel()
+      self._maintenance = None
+    for account_id in list(self._clients):
+      await self._drop(account_id)
+
+  async def _connect(
+    self, api_id: int, api_hash: str, session_string: str | None, account_id: int
+  ) -> TelegramClient:
+    # Reconnect a known client instead of replacing it, so event handlers
+    # registered on it survive
+    client = self._clients.get(account_id)
+    if client is None:
+      # Peer access hashes survive restarts in the DB, not in the string
+      session = DbSession(session_string, account_id)
+      client = TelegramClient(session, api_id, api_hash)
+      client.account_id = account_id
+
+    started = time.perf_counter()
+    await client.connect()
+    self._connect_count += 1
+    self._connect_seconds += time.perf_counter() - started
+
+    self._clients[account_id] = client
+    self._touch(account_id)
+    await self._evict_overflow(keep=account_id)
+    return client
+
+  def _touch(self, account_id: int) -> None:
+    self._clients.move_to_end(account_id)
+    self._last_used[account_id] = time.monotonic()
+
+  async def _evict_overflow(self, keep: int) -> None:
+    # The client just connected for `keep` is about to be handed out
+    for account_id in list(self._clients):
+      if len(self._clients) <= self.max_size:
+        return
+      if account_id != keep and not self._in_use(account_id):
+        self._evictions += 1
+        await self._drop(account_id)
+
+  def _in_use(self, account_id: int) -> bool:
+    return account_id in self._pinned or account_id in self._leases
+
+  async def _drop(self, account_id: int) -> None:
+    client = self._clients.pop(account_id, None)
+    self._last_used.pop(account_id, None)
+    if client is not None and client.is_connected():
+      try:
+        await client.disconnect()
+      except Exception:
+        pass
+
+  def _ensure_maintenance(self) -> None:
+    if self._maintenance is None or self._maintenance.done():
+      self._maintenance = asyncio.create_task(self._maintain())
+
+  async def _maintain(self) -> None:
+    while True:
+      await asyncio.sleep(PING_INTERVAL)
+      expire_pending_logins()
+      now = time.monotonic()
+      for account_id, client in list(self._clients.items()):
+        if self._in_use(account_id):
+          continue
+        if now - self._last_used.get(account_id, now) > self.idle_timeout:
+          self._evictions += 1
+          await self._drop(account_id)
+        elif client.is_connected() and not await self._ping(client):
+          await self._drop(account_id)
+
+  @staticmethod
+  async def _ping(client: TelegramClient) -> bool:
+    try:
+      await asyncio.wait_for(
+        client(functions.PingRequest(ping_id=random.getrandbits(63))),
+        timeout=PING_TIMEOUT,
+      )
+      return True
+    except Exception:
+      return False
+
+
+pool = ClientPool()
 
 
 async def get_client(
@@ -15,27 +209,52 @@ async def get_client(
   session_string: str | None = None,
   account_id: int | None = None,
 ) -> TelegramClient:
-  """Get or create a TelegramClient instance"""
-  if account_id and account_id in _active_clients:
-    client = _active_clients[account_id]
-    if client.is_connected():
-      return client
+  """Get a TelegramClient instance.
 
-  client = TelegramClient(StringSession(session_string), api_id, api_hash)
+  Account clients come connected from the shared pool. Without an
+  account_id (e.g. during login) a fresh, unconnected client is returned.
+  """
   if account_id:
-    client.account_id = account_id
-    _active_clients[account_id] = client
-  return client
+    return await pool.acquire(api_id, api_hash, session_string, account_id)
+  return TelegramClient(StringSession(session_string), api_id, api_hash)
+
+
+def client_lease(
+  api_id: int, api_hash: str, session_string: str | None, account_id: int
+):
+  """Pooled client of an account held for the duration of an `async with`.
+
+  Use it for anything longer than a single request (fetches, reviews), so
+  the pool does not disconnect the client mid-use.
+  """
+  return pool.lease(api_id, api_hash, session_string, account_id)
+
+
+def expire_pending_logins() -> None:
+  """Drop logins whose code did not arrive within PENDING_LOGIN_TTL."""
+  now = time.monotonic()
+  for phone, (code_future, result_future, client, started_at) in list(
+    _pending_logins.items()
+  ):
+    if now - started_at < PENDING_LOGIN_TTL:
+      continue
+    del _pending_logins[phone]
+    for future in (code_future, result_future):
+      if not future.done():
+        future.set_exception(TimeoutError("Login code was not provided in time"))
+    if client.is_connected():
+      asyncio.ensure_future(client.disconnect())
 
 
 async def sign_in_request(client: TelegramClient, phone: str):
   """
   Starts the sign-in process.
   """
+  expire_pending_logins()
   loop = asyncio.get_running_loop()
   code_future = loop.create_future()
   result_future = loop.create_future()
-  _pending_logins[phone] = (code_future, result_future, client)
+  _pending_logins[phone] = (code_future, result_future, client, time.monotonic())
 
   async def code_callback():
     return await code_future
@@ -59,10 +278,11 @@ async def sign_in_request(client: TelegramClient, phone: str):
 
 async def wait_for_login(phone: str, code: str):
   """Provide the code and wait for the result"""
+  expire_pending_logins()
   if phone not in _pending_logins:
     return None
 
-  code_future, result_future, _ = _pending_logins[phone]
+  code_future, result_future, _, _ = _pending_logins[phone]
   if not code_future.done():
     code_future.set_result(code)
 
@@ -91,4 +311,5 @@ def run_async(func, *args, **kwargs):
   try:
     return loop.run_until_complete(func(*args, **kwargs))
   finally:
+    loop.run_until_complete(pool.close())
     loop.close()
@@ -1,5 +1,7 @@
-from telethon.tl import custom as teletypes
+from telethon import utils
+from telethon.tl import custom as teletypes, types
 from shared.models import DialogType, PeerType
+from shared.text import text_fingerprints
 
 
 def extract_dialog_type(dialog: teletypes.Dialog) -> DialogType:
@@ -41,3 +43,41 @@ def extract_peer_id(message: teletypes.Message) -> int:
       return val
 
   raise ValueError(f"Could not extract peer id from {message}")
+
+
+def message_to_row(message: teletypes.Message) -> dict:
+  """Flatten a Telethon message into `Message` column values (without dialog_id)."""
+  return {
+    "telegram_id": message.id,
+    "from_id": extract_peer_id(message),
+    "from_type": extract_peer_type(message),
+    "text": message.message,
+    "date": message.date,
+    **text_fingerprints(message.message),
+  }
+
+
+def dialog_to_row(dialog: teletypes.Dialog) -> dict:
+  """Flatten a Telethon dialog into `Dialog` column values (without account_id)."""
+  return {
+    "telegram_id": dialog.id,
+    "name": dialog.name,
+    "username": getattr(dialog.entity, "username", None),
+    "entity_type": extract_dialog_type(dialog),
+  }
+
+
+def entity_to_dialog_row(entity: types.User | types.Chat | types.Channel) -> dict:
+  """Build `Dialog` column values from a raw entity, mirroring custom.Dialog."""
+  if isinstance(entity, types.User):
+    entity_type = DialogType.USER
+  elif isinstance(entity, types.Chat) or getattr(entity, "megagroup", False):
+    entity_type = DialogType.GROUP
+  else:
+    entity_type = DialogType.CHANNEL
+  return {
+    "telegram_id": utils.get_peer_id(entity),
+    "name": utils.get_display_name(entity),
+    "username": getattr(entity, "username", None),
+    "entity_type": entity_type,
+  }
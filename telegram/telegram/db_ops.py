@@ -0,0 +1,213 @@
+from collections.abc import Iterable
+from datetime import datetime, timezone
+from sqlalchemy import func, literal, or_, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select
+from shared.models import (
+  Dialog,
+  Message,
+  PeerEntity,
+  Prompt,
+  ReviewQueueItem,
+  VacancyReview,
+  utc_now,
+)
+
+# SQLite limits bound parameters per statement, keep multi-row inserts below it
+MESSAGE_CHUNK_SIZE = 500
+
+_MESSAGE_UPDATE_COLUMNS = (
+  "from_id",
+  "from_type",
+  "text",
+  "date",
+  "text_hash",
+  "simhash",
+  "simhash_band_0",
+  "simhash_band_1",
+  "simhash_band_2",
+  "simhash_band_3",
+)
+_DIALOG_UPDATE_COLUMNS = ("name", "username", "entity_type")
+_PEER_UPDATE_COLUMNS = (
+  "access_hash",
+  "peer_type",
+  "username",
+  "phone",
+  "name",
+  "updated_at",
+)
+
+
+def get_dialog(
+  session: Session, account_id: int | None, telegram_id: int
+) -> Dialog | None:
+  """Find the internal dialog row for a Telegram dialog ID."""
+  return session.exec(
+    select(Dialog).where(
+      Dialog.telegram_id == telegram_id, Dialog.account_id == account_id
+    )
+  ).first()
+
+
+def advance_dialog_cursor(
+  session: Session, dialog_id: int, last_message_id: int | None
+) -> None:
+  """Move the dialog high-watermark forward and stamp the sync time.
+
+  The cursor never moves backwards. Does not commit.
+  """
+  values: dict = {"last_synced_at": datetime.now(timezone.utc)}
+  if last_message_id is not None:
+    values["last_message_id"] = func.max(
+      func.coalesce(Dialog.last_message_id, 0), last_message_id
+    )
+  session.execute(update(Dialog).where(Dialog.id == dialog_id).values(**values))
+
+
+def upsert_messages(
+  session: Session, dialog_id: int, rows: list[dict]
+) -> tuple[int, int]:
+  """Bulk insert or update message rows of one dialog.
+
+  Each chunk costs one SELECT for the already stored ids and one
+  INSERT ... ON CONFLICT DO UPDATE. Stored messages are only rewritten
+  when their text hash changed; reviews of such edited messages are marked
+  stale (see `mark_reviews_stale`). Returns (inserted, updated) counts.
+  Does not commit.
+  """
+  inserted = updated = 0
+  for start in range(0, len(rows), MESSAGE_CHUNK_SIZE):
+    chunk = rows[start : start + MESSAGE_CHUNK_SIZE]
+    telegram_ids = {row["telegram_id"] for row in chunk}
+
+    existing_ids = set(
+      session.exec(
+        select(Message.telegram_id).where(
+          Message.dialog_id == dialog_id,
+          Message.telegram_id.in_(telegram_ids),  # type: ignore[attr-defined]
+        )
+      ).all()
+    )
+
+    statement = insert(Message).values(
+      [{**row, "dialog_id": dialog_id} for row in chunk]
+    )
+    statement = statement.on_conflict_do_update(
+      index_elements=["telegram_id", "dialog_id"],
+      set_={column: statement.excluded[column] for column in _MESSAGE_UPDATE_COLUMNS},
+      where=Message.text_hash.is_distinct_from(statement.excluded.text_hash),  # type: ignore[union-attr]
+    ).returning(Message.id, Message.telegram_id)
+    written = session.execute(statement).all()
+
+    edited_ids = [row.id for row in written if row.telegram_id in existing_ids]
+    mark_reviews_stale(session, edited_ids)
+    updated += len(edited_ids)
+    inserted += len(telegram_ids) - len(existing_ids)
+  return inserted, updated
+
+
+def mark_reviews_stale(session: Session, message_ids: list[int]) -> None:
+  """Flag reviews of edited messages and queue the messages for a new review.
+
+  Messages are queued for the latest version of the prompt that reviewed
+  them. An item already queued starts over unleased, so the review a worker
+  may be writing for the old text is not saved (see `agents.db_ops`).
+  Does not commit.
+  """
+  if not message_ids:
+    return
+  session.execute(
+    update(VacancyReview)
+    .where(VacancyReview.message_id.in_(message_ids))  # type: ignore[attr-defined]
+    .values(is_stale=True)
+  )
+  latest_version = (
+    select(func.max(Prompt.version))
+    .where(Prompt.id == VacancyReview.prompt_id)
+    .scalar_subquery()
+  )
+  source = select(
+    VacancyReview.message_id,
+    VacancyReview.prompt_id,
+    latest_version,
+    literal(0),
+    literal(utc_now()),
+  ).where(
+    VacancyReview.message_id.in_(message_ids),  # type: ignore[attr-defined]
+    VacancyReview.prompt_id != None,  # noqa: E711
+  )
+  statement = insert(ReviewQueueItem).from_select(
+    ["message_id", "prompt_id", "prompt_version", "attempts", "enqueued_at"],
+    source,
+  )
+  session.execute(
+    statement.on_conflict_do_update(
+      index_elements=["message_id", "prompt_id"],
+      set_={
+        "prompt_version": statement.excluded.prompt_version,
+        "attempts": 0,
+        "lease_owner": None,
+        "lease_expires_at": None,
+      },
+    )
+  )
+
+
+def upsert_dialogs(session: Session, account_id: int, rows: list[dict]) -> int:
+  """Bulk insert or update dialog rows of one account.
+
+  Rows whose name, username and type are unchanged are skipped by the
+  conflict clause, so SQLite does not rewrite them. Returns the number of
+  rows actually inserted or updated. Does not commit.
+  """
+  if not rows:
+    return 0
+  statement = insert(Dialog).values([{**row, "account_id": account_id} for row in rows])
+  statement = statement.on_conflict_do_update(
+    index_elements=["telegram_id", "account_id"],
+    set_={column: statement.excluded[column] for column in _DIALOG_UPDATE_COLUMNS},
+    where=or_(
+      *(
+        getattr(Dialog, column).is_distinct_from(statement.excluded[column])
+        for column in _DIALOG_UPDATE_COLUMNS
+      )
+    ),
+  )
+  return session.execute(statement).rowcount
+
+
+def upsert_peer_entities(session: Session, account_id: int, rows: list[dict]) -> None:
+  """Bulk insert or update cached peer entities of one account. Does not commit."""
+  for start in range(0, len(rows), MESSAGE_CHUNK_SIZE):
+    chunk = rows[start : start + MESSAGE_CHUNK_SIZE]
+    statement = insert(PeerEntity).values(
+      [{**row, "account_id": account_id} for row in chunk]
+    )
+    statement = statement.on_conflict_do_update(
+      index_elements=["account_id", "peer_id"],
+      set_={column: statement.excluded[column] for column in _PEER_UPDATE_COLUMNS},
+    )
+    session.execute(statement)
+
+
+def load_peer_entities(session: Session, account_id: int) -> list[PeerEntity]:
+  """All cached peer entities of one account."""
+  return list(
+    session.exec(select(PeerEntity).where(PeerEntity.account_id == account_id)).all()
+  )
+
+
+def get_fresh_peer_entities(
+  session: Session, account_id: int, peer_ids: Iterable[int], since: datetime
+) -> list[PeerEntity]:
+  """Cached peer entities of one account that were confirmed after `since`."""
+  return list(
+    session.exec(
+      select(PeerEntity).where(
+        PeerEntity.account_id == account_id,
+        PeerEntity.peer_id.in_(set(peer_ids)),  # type: ignore[attr-defined]
+        PeerEntity.updated_at >= since,
+      )
+    ).all()
+  )
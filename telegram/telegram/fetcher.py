@@ -0,0 +1,182 @@
+import asyncio
+import time
+from collections.abc import AsyncIterable, Iterable
+from datetime import datetime
+from telethon.errors import FloodWaitError
+from . import service
+from .ingest import MessageWriter
+
+DEFAULT_CONCURRENCY = 4
+# How many flood waits a single dialog may hit before it is given up on
+MAX_FLOOD_RETRIES = 3
+# Request class every dialog fetch starts with (iter_messages)
+HISTORY_REQUEST_CLASS = "GetHistoryRequest"
+
+
+class FloodGate:
+  """Tracks FloodWait pauses per Telegram request class.
+
+  A FloodWait only blocks the request class that triggered it, so other
+  kinds of requests keep going while that class cools down.
+  """
+
+  def __init__(self):
+    self._paused_until: dict[str, float] = {}
+
+  def pause(self, request_class: str, seconds: int) -> None:
+    until = asyncio.get_running_loop().time() + seconds
+    self._paused_until[request_class] = max(
+      self._paused_until.get(request_class, 0.0), until
+    )
+
+  async def wait(self, *request_classes: str) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+      until = max((self._paused_until.get(c, 0.0) for c in request_classes), default=0)
+      delay = until - loop.time()
+      if delay <= 0:
+        return
+      await asyncio.sleep(delay)
+
+
+def _request_class(error: FloodWaitError) -> str:
+  request = getattr(error, "request", None)
+  return type(request).__name__ if request is not None else HISTORY_REQUEST_CLASS
+
+
+async def _aiter(items: AsyncIterable | Iterable):
+  if isinstance(items, AsyncIterable):
+    async for item in items:
+      yield item
+  else:
+    for item in items:
+      yield item
+
+
+async def iter_fetch_dialogs(
+  client,
+  dialogs: AsyncIterable | Iterable,
+  new_only: bool,
+  max_messages: int | None,
+  date_from: datetime | None,
+  date_to: datetime | None,
+  dry_run: bool = False,
+  concurrency: int = DEFAULT_CONCURRENCY,
+):
+  """Fetch messages of several dialogs of one account concurrently.
+
+  At most `concurrency` dialogs are fetched at once. A dialog that hits a
+  FloodWait pauses only the affected request class and is retried once the
+  pause is over, while the remaining dialogs go on. All dialogs share one
+  MessageWriter. Yields (report, result) per dialog in completion order,
+  where result is what `service.get_messages` returned and report holds the
+  per-dialog counts and timing.
+  """
+  concurrency = max(1, concurrency)
+  gate = FloodGate()
+  slots = asyncio.Semaphore(concurrency)
+  # Bounds how many dialogs are held in memory while waiting for a slot
+  admission = asyncio.Semaphore(concurrency * 4)
+  done: asyncio.Queue = asyncio.Queue()
+  writer = MessageWriter()
+  fetch_args = (new_only, max_messages, date_from, date_to, dry_run, writer)
+
+  async def fetch_one(dialog):
+    try:
+      done.put_nowait(await _fetch_dialog(client, dialog, fetch_args, gate, slots))
+    finally:
+      admission.release()
+
+  async def produce():
+    try:
+      async with asyncio.TaskGroup() as tasks:
+        async for dialog in _aiter(dialogs):
+          await admission.acquire()
+          tasks.create_task(fetch_one(dialog))
+    except BaseExceptionGroup as group:
+      # TaskGroup wraps every error, pass a single one (e.g. an unknown
+      # folder) through unchanged so callers can catch it by type
+      if len(group.exceptions) == 1:
+        raise group.exceptions[0] from None
+      raise
+    finally:
+      done.put_nowait(None)
+
+  async with writer:
+    producer = asyncio.create_task(produce())
+    try:
+      while (item := await done.get()) is not None:
+        yield item
+    except BaseException:
+      producer.cancel()
+      raise
+    await producer
+
+
+async def fetch_dialogs(
+  client,
+  dialogs: AsyncIterable | Iterable,
+  new_only: bool,
+  max_messages: int | None,
+  date_from: datetime | None,
+  date_to: datetime | None,
+  dry_run: bool = False,
+  concurrency: int = DEFAULT_CONCURRENCY,
+) -> list[dict]:
+  """Fetch messages of several dialogs concurrently and return per-dialog reports."""
+  return [
+    report
+    async for report, _ in iter_fetch_dialogs(
+      client,
+      dialogs,
+      new_only,
+      max_messages,
+      date_from,
+      date_to,
+      dry_run=dry_run,
+      concurrency=concurrency,
+    )
+  ]
+
+
+async def _fetch_dialog(
+  client, dialog, fetch_args: tuple, gate: FloodGate, slots: asyncio.Semaphore
+) -> tuple[dict, dict]:
+  report = {
+    "chat_name": dialog.name,
+    "chat_id": dialog.id,
+    "message_count": 0,
+    "inserted": 0,
+    "updated": 0,
+    "elapsed": 0.0,
+    "flood_waits": 0,
+    "error": None,
+  }
+  result: dict = {}
+  blocked_on = HISTORY_REQUEST_CLASS
+  started = time.perf_counter()
+
+  for _ in range(MAX_FLOOD_RETRIES + 1):
+    # Wait for the class that stopped this dialog outside the slot, so a
+    # paused dialog does not hold back others
+    await gate.wait(blocked_on)
+    async with slots:
+      await gate.wait(HISTORY_REQUEST_CLASS)
+      try:
+        result = await service.get_messages(client, dialog, *fetch_args)
+        break
+      except FloodWaitError as e:
+        blocked_on = _request_class(e)
+        gate.pause(blocked_on, e.seconds)
+        report["flood_waits"] += 1
+      except Exception as e:
+        report["error"] = str(e)
+        break
+  else:
+    report["error"] = f"Gave up after {MAX_FLOOD_RETRIES} flood waits"
+
+  report["message_count"] = result.get("fetched", 0)
+  report["inserted"] = result.get("inserted", 0)
+  report["updated"] = result.get("updated", 0)
+  report["elapsed"] = round(time.perf_counter() - started, 3)
+  return report, result
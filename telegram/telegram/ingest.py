@@ -0,0 +1,98 @@
+import asyncio
+from shared import models as db
+from .db_ops import advance_dialog_cursor, upsert_messages
+
+# Rows per page handed from a downloader to the writer
+PAGE_SIZE = 100
+# Pages buffered between downloaders and the writer, bounds memory use
+QUEUE_SIZE = 20
+# Pages merged into a single write transaction when the writer falls behind
+MAX_PAGES_PER_FLUSH = 10
+
+
+class MessageWriter:
+  """Single writer task that flushes downloaded message pages to SQLite.
+
+  Downloaders `put` pages of rows and keep downloading while the writer
+  upserts them in a worker thread, so the event loop never blocks on
+  SQLite. The queue is bounded, so a slow writer applies backpressure
+  instead of letting pages pile up in memory. `finish` advances the dialog
+  cursor after all of its pages are written and returns the dialog counts.
+  """
+
+  def __init__(self, queue_size: int = QUEUE_SIZE):
+    self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    self._task: asyncio.Task | None = None
+    self._stats: dict[int, dict] = {}
+    self._errors: dict[int, Exception] = {}
+
+  async def __aenter__(self):
+    self._task = asyncio.create_task(self._run())
+    return self
+
+  async def __aexit__(self, *exc_info):
+    await self._queue.put(None)
+    if self._task:
+      await self._task
+
+  async def put(self, dialog_id: int, rows: list[dict]) -> None:
+    if rows:
+      await self._queue.put(("rows", dialog_id, rows))
+
+  async def finish(self, dialog_id: int, last_message_id: int | None) -> dict:
+    """Wait until every queued page of the dialog is written.
+
+    Returns {"inserted": ..., "updated": ...} for the dialog.
+    """
+    future = asyncio.get_running_loop().create_future()
+    await self._queue.put(("finish", dialog_id, last_message_id, future))
+    return await future
+
+  async def _run(self):
+    while True:
+      items = [await self._queue.get()]
+      while len(items) < MAX_PAGES_PER_FLUSH and not self._queue.empty():
+        items.append(self._queue.get_nowait())
+
+      stop = None in items
+      items = [item for item in items if item is not None]
+      if items:
+        await self._flush(items)
+      if stop:
+        return
+
+  async def _flush(self, items: list[tuple]):
+    try:
+      await asyncio.to_thread(self._write, items)
+    except Exception as e:
+      # Counts of the failed dialogs include pages that were never committed
+      for item in items:
+        self._errors[item[1]] = e
+        self._stats.pop(item[1], None)
+
+    for item in items:
+      if item[0] != "finish":
+        continue
+      _, dialog_id, _, future = item
+      stats = self._stats.pop(dialog_id, {"inserted": 0, "updated": 0})
+      error = self._errors.pop(dialog_id, None)
+      if future.done():
+        continue
+      if error:
+        future.set_exception(error)
+      else:
+        future.set_result(stats)
+
+  def _write(self, items: list[tuple]):
+    with db.session_context() as session:
+      for item in items:
+        if item[0] == "rows":
+          _, dialog_id, rows = item
+          inserted, updated = upsert_messages(session, dialog_id, rows)
+          stats = self._stats.setdefault(dialog_id, {"inserted": 0, "updated": 0})
+          stats["inserted"] += inserted
+          stats["updated"] += updated
+        elif item[1] not in self._errors:
+          _, dialog_id, last_message_id, _ = item
+          advance_dialog_cursor(session, dialog_id, last_message_id)
+      session.commit()
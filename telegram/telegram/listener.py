@@ -0,0 +1,140 @@
+import asyncio
+from telethon import events
+from sqlmodel import select
+from shared import models as db
+from .client import get_client, pool
+from .converters import entity_to_dialog_row, message_to_row
+from .db_ops import get_dialog, upsert_dialogs
+from .ingest import PAGE_SIZE, MessageWriter
+
+# Seconds buffered update events wait before being flushed to the DB
+FLUSH_INTERVAL = 2.0
+
+# Running listeners: {account_id: UpdateListener}
+_listeners: dict[int, "UpdateListener"] = {}
+
+
+class UpdateListener:
+  """Ingests new and edited messages of one account from update events.
+
+  Incoming messages are buffered per dialog and flushed through a
+  MessageWriter every FLUSH_INTERVAL seconds, or sooner once a page fills.
+  The fetch cursor is left alone, since updates can be missed while the
+  client is disconnected and the next fetch has to pick those up.
+  """
+
+  def __init__(self, client, account_id: int):
+    self.client = client
+    self.account_id = account_id
+    self._writer = MessageWriter()
+    self._buffer: dict[int, list[dict]] = {}
+    self._dialog_ids: dict[int, int] = {}
+    self._flush_task: asyncio.Task | None = None
+    self._page_full = asyncio.Event()
+
+  async def start(self):
+    await self._writer.__aenter__()
+    self._flush_task = asyncio.create_task(self._flush_loop())
+    self.client.add_event_handler(self._on_message, events.NewMessage())
+    self.client.add_event_handler(self._on_message, events.MessageEdited())
+
+  async def stop(self):
+    self.client.remove_event_handler(self._on_message)
+    if self._flush_task:
+      self._flush_task.cancel()
+      try:
+        await self._flush_task
+      except asyncio.CancelledError:
+        pass
+    await self._flush()
+    await self._writer.__aexit__(None, None, None)
+
+  async def _on_message(self, event):
+    dialog_id = await self._get_dialog_id(event)
+    rows = self._buffer.setdefault(dialog_id, [])
+    rows.append(message_to_row(event.message))
+    if len(rows) >= PAGE_SIZE:
+      self._page_full.set()
+
+  async def _get_dialog_id(self, event) -> int:
+    if event.chat_id in self._dialog_ids:
+      return self._dialog_ids[event.chat_id]
+
+    with db.session_context() as session:
+      dialog = get_dialog(session, self.account_id, event.chat_id)
+    if not dialog:
+      # First message from a chat that was never synced
+      row = entity_to_dialog_row(await event.get_chat())
+      with db.session_context() as session:
+        upsert_dialogs(session, self.account_id, [row])
+        session.commit()
+        dialog = get_dialog(session, self.account_id, event.chat_id)
+
+    self._dialog_ids[event.chat_id] = dialog.id
+    return dialog.id
+
+  async def _flush_loop(self):
+    while True:
+      try:
+        await asyncio.wait_for(self._page_full.wait(), timeout=FLUSH_INTERVAL)
+      except asyncio.TimeoutError:
+        pass
+      self._page_full.clear()
+      await self._flush()
+
+  async def _flush(self):
+    buffer, self._buffer = self._buffer, {}
+    for dialog_id, rows in buffer.items():
+      try:
+        await self._writer.put(dialog_id, rows)
+        await self._writer.finish(dialog_id, None)
+      except Exception as e:
+        # Dropped on purpose, retrying could pile up rows that never write.
+        # New messages come back with the next fetch, the cursor did not move
+        print(
+          f"Failed to save {len(rows)} updates of dialog {dialog_id} "
+          f"for account {self.account_id}: {e}"
+        )
+
+
+async def start_listener(client, account_id: int) -> UpdateListener:
+  """Start ingesting updates of an account, if not already running."""
+  if account_id in _listeners:
+    return _listeners[account_id]
+  listener = UpdateListener(client, account_id)
+  await listener.start()
+  _listeners[account_id] = listener
+  # Keep the client connected for as long as it delivers updates
+  pool.pin(account_id)
+  return listener
+
+
+async def start_enabled_listeners() -> None:
+  """Start listeners for every authorized account that opted in."""
+  with db.session_context() as session:
+    statement = select(db.TelegramAccount).where(
+      db.TelegramAccount.listen_updates == True  # noqa: E712
+    )
+    accounts = session.exec(statement).all()
+
+  for account in accounts:
+    try:
+      client = await get_client(
+        account.api_id, account.api_hash, account.session_string, account.id
+      )
+      if await client.is_user_authorized():
+        await start_listener(client, account.id)
+    except Exception as e:
+      print(f"Failed to start listener for account {account.id}: {e}")
+
+
+async def stop_listener(account_id: int) -> None:
+  listener = _listeners.pop(account_id, None)
+  if listener:
+    pool.unpin(account_id)
+    await listener.stop()
+
+
+async def stop_all_listeners() -> None:
+  for account_id in list(_listeners):
+    await stop_listener(account_id)
@@ -1,8 +1,20 @@
-from datetime import datetime, timedelta
-from telethon import functions, types
-from sqlmodel import select
+import copy
+from collections.abc import Iterable
+from datetime import datetime, timedelta, timezone
+from telethon import functions, types, utils
 from shared import models as db
-from .converters import extract_dialog_type, extract_peer_type, extract_peer_id
+from . import cache
+from .converters import dialog_to_row, message_to_row
+from .db_ops import get_dialog, get_fresh_peer_entities, upsert_dialogs
+from .ingest import PAGE_SIZE, MessageWriter
+from .session import DbSession, flush_entities
+
+# Dialogs are written to the DB in chunks of this size while streaming
+DIALOG_CHUNK_SIZE = 200
+# Usernames cached in PeerEntity are trusted for this long
+USERNAME_TTL = timedelta(days=1)
+# Users requested per users.GetUsers call
+GET_USERS_CHUNK_SIZE = 100
 
 
 async def get_messages(
@@ -13,164 +25,184 @@ async def get_messages(
   date_from: datetime | None,
   date_to: datetime | None,
   dry_run: bool = False,
-):
+  writer: MessageWriter | None = None,
+) -> dict:
+  """Download messages of a dialog and stream them to the DB.
+
+  Pages go to `writer` (a private one is started when not given) while the
+  download continues. Returns counts: {"fetched", "inserted", "updated"}.
+  In dry run nothing is written and the would-be rows are returned under
+  "messages" instead.
+  """
+  telegram_id = dialog if isinstance(dialog, int) else dialog.id
   if isinstance(dialog, int):
     try:
       dialog = await client.get_entity(dialog)
     except Exception:
       # Fallback to get_dialogs if get_entity fails
-      dialogs = await client.get_dialogs(limit=None)
+      dialogs = await cache.get_dialogs(client)
       try:
         dialog = next(d for d in dialogs if d.id == dialog)
       except StopIteration:
         raise ValueError(f"Dialog with ID {dialog} not found")
 
+  account_id = getattr(client, "account_id", None)
+  with db.session_context() as session:
+    internal_dialog = get_dialog(session, account_id, telegram_id)
+    if not internal_dialog and not dry_run:
+      # If dialog not synced yet, sync it
+      internal_dialog = db.Dialog(account_id=account_id, **dialog_to_row(dialog))
+      session.add(internal_dialog)
+      session.commit()
+      session.refresh(internal_dialog)
+    cursor = internal_dialog.last_message_id if internal_dialog else None
+    dialog_pk = internal_dialog.id if internal_dialog else None
+
+  fetch_args = (cursor, new_only, max_messages, date_from, date_to)
+  if dry_run:
+    rows = [row async for row in _iter_message_rows(client, dialog, *fetch_args)]
+    return {"fetched": len(rows), "inserted": 0, "updated": 0, "messages": rows}
+
+  if writer is None:
+    async with MessageWriter() as own_writer:
+      return await _write_messages(client, dialog, dialog_pk, fetch_args, own_writer)
+  return await _write_messages(client, dialog, dialog_pk, fetch_args, writer)
+
+
+async def _write_messages(
+  client, dialog, dialog_pk: int, fetch_args: tuple, writer: MessageWriter
+) -> dict:
+  """Stream message pages of a dialog to the writer and advance its cursor."""
+  _, new_only, _, _, date_to = fetch_args
+  fetched = 0
+  newest_id = None
+  page: list[dict] = []
+  async for row in _iter_message_rows(client, dialog, *fetch_args):
+    fetched += 1
+    newest_id = max(newest_id or 0, row["telegram_id"])
+    page.append(row)
+    if len(page) >= PAGE_SIZE:
+      await writer.put(dialog_pk, page)
+      page = []
+  await writer.put(dialog_pk, page)
+
+  # Only a cursor-anchored or newest-first fetch is contiguous, so only
+  # those may move the cursor forward
+  advance_cursor = new_only and date_to is None
+  stats = await writer.finish(dialog_pk, newest_id if advance_cursor else None)
+
+  if newest_id is not None:
+    await client.send_read_acknowledge(dialog, max_id=newest_id)
+  await flush_entities(client)
+
+  return {"fetched": fetched, **stats}
+
+
+async def _iter_message_rows(
+  client,
+  dialog,
+  cursor: int | None,
+  new_only: bool,
+  max_messages: int | None,
+  date_from: datetime | None,
+  date_to: datetime | None,
+):
+  """Yield message rows of a dialog within the requested window."""
+  date_from = _as_utc(date_from)
+  date_to = _as_utc(date_to)
+
   kwargs = {
     "entity": dialog,
     "limit": max_messages,
   }
 
-  if date_to:
-    date_to += timedelta(seconds=1)
-    msgs = await client.get_messages(dialog, limit=1, offset_date=date_to)
-    if not msgs:
-      return []
-    kwargs["max_id"] = msgs[0].id + 1
-
-  if date_from:
-    date_from -= timedelta(seconds=1)
-    msgs = await client.get_messages(dialog, limit=1, offset_date=date_from)
-    if msgs:
-      kwargs["min_id"] = msgs[0].id
-
-  if new_only:
-    if dialog.unread_count <= 0:
-      return []
-    unread_limit = dialog.unread_count
-    if kwargs.get("limit"):
-      kwargs["limit"] = min(kwargs["limit"], unread_limit)
-    else:
-      kwargs["limit"] = unread_limit
+  # With a cursor, walk forward from it so a limited fetch never leaves a gap
+  # between the cursor and the oldest downloaded message
+  reverse = new_only and cursor is not None
+  if reverse:
+    kwargs["min_id"] = cursor
+    kwargs["reverse"] = True
+  elif date_to:
+    # offset_date is exclusive
+    kwargs["offset_date"] = date_to + timedelta(seconds=1)
 
-  messages = []
   async for message in client.iter_messages(**kwargs):
-    messages.append(message)
+    if date_to and message.date > date_to:
+      if reverse:
+        break
+      continue
+    if date_from and message.date < date_from:
+      if reverse:
+        continue
+      break
+    yield message_to_row(message)
 
-  if not dry_run and messages:
-    account_id = getattr(client, "account_id", None)
-    with db.session_context() as session:
-      # Find internal dialog ID first
-      dialog_stmt = select(db.Dialog).where(
-        db.Dialog.telegram_id == dialog.id, db.Dialog.account_id == account_id
-      )
-      internal_dialog = session.exec(dialog_stmt).first()
-      if not internal_dialog:
-        # If dialog not synced yet, sync it
-        internal_dialog = db.Dialog(
-          telegram_id=dialog.id,
-          account_id=account_id,
-          name=dialog.name,
-          username=dialog.entity.username
-          if hasattr(dialog.entity, "username")
-          else None,
-          entity_type=extract_dialog_type(dialog),
-        )
-        session.add(internal_dialog)
-        session.commit()
-        session.refresh(internal_dialog)
-
-      for message in messages:
-        from_id = extract_peer_id(message)
-
-        # Upsert Message
-        msg_stmt = select(db.Message).where(
-          db.Message.telegram_id == message.id,
-          db.Message.dialog_id == internal_dialog.id,
-        )
-        existing_msg = session.exec(msg_stmt).first()
-
-        if existing_msg:
-          existing_msg.text = message.message
-          existing_msg.date = message.date
-          existing_msg.from_id = from_id
-          existing_msg.from_type = extract_peer_type(message)
-          session.add(existing_msg)
-        else:
-          message_model = db.Message(
-            telegram_id=message.id,
-            dialog_id=internal_dialog.id,
-            from_id=from_id,
-            from_type=extract_peer_type(message),
-            text=message.message,
-            date=message.date,
-          )
-          session.add(message_model)
-      session.commit()
-    await messages[0].mark_read()
 
-  return messages
+def _as_utc(value: datetime | None) -> datetime | None:
+  """Treat naive datetimes as UTC so they compare with Telethon message dates."""
+  if value is not None and value.tzinfo is None:
+    return value.replace(tzinfo=timezone.utc)
+  return value
 
 
-async def sync_dialogs(client, folder_id: int | None = None, dry_run: bool = False):
-  """Fetch dialogs and save to local DB"""
-  dialogs = await client.get_dialogs(limit=None)
+async def iter_synced_dialogs(
+  client, folder_id: int | None = None, dry_run: bool = False
+):
+  """Stream dialogs from Telegram, saving them to local DB in chunks.
 
+  Dialogs are yielded only after their chunk is written, so consumers can
+  rely on the `Dialog` row existing. At most one chunk is held in memory.
+  """
+  included_peer_ids = None
   if folder_id is not None:
     # If folder_id is provided, we filter by that folder's peers
-    filters_resp = await client(functions.messages.GetDialogFiltersRequest())
+    filters = await cache.get_dialog_filters(client)
     target_filter = next(
-      (f for f in filters_resp.filters if getattr(f, "id", None) == folder_id), None
+      (f for f in filters if getattr(f, "id", None) == folder_id), None
     )
     if not target_filter:
       raise ValueError(f"Folder with ID {folder_id} not found.")
 
-    included_peer_ids = []
-    if hasattr(target_filter, "include_peers"):
-      for peer in target_filter.include_peers:
-        included_peer_ids.append(get_peer_id(peer))
-
-    dialogs = [d for d in dialogs if d.id in included_peer_ids]
+    included_peer_ids = {
+      get_peer_id(peer) for peer in getattr(target_filter, "include_peers", [])
+    }
+
+  account_id = getattr(client, "account_id", None)
+  persist = not dry_run and bool(account_id)
+
+  chunk = []
+  async for dialog in client.iter_dialogs():
+    if included_peer_ids is not None and dialog.id not in included_peer_ids:
+      continue
+    chunk.append(dialog)
+    if len(chunk) >= DIALOG_CHUNK_SIZE:
+      if persist:
+        _save_dialogs(account_id, chunk)
+      for synced in chunk:
+        yield synced
+      chunk = []
+
+  if chunk:
+    if persist:
+      _save_dialogs(account_id, chunk)
+    for synced in chunk:
+      yield synced
 
   if not dry_run:
-    account_id = getattr(client, "account_id", None)
-    if not account_id:
-      return dialogs
+    await flush_entities(client)
 
-    with db.session_context() as session:
-      for dialog in dialogs:
-        stmt = select(db.Dialog).where(
-          db.Dialog.telegram_id == dialog.id, db.Dialog.account_id == account_id
-        )
-        existing_dialog = session.exec(stmt).first()
-
-        if existing_dialog:
-          existing_dialog.name = dialog.name
-          existing_dialog.username = (
-            dialog.entity.username if hasattr(dialog.entity, "username") else None
-          )
-          existing_dialog.entity_type = extract_dialog_type(dialog)
-          session.add(existing_dialog)
-        else:
-          dialog_model = db.Dialog(
-            telegram_id=dialog.id,
-            account_id=account_id,
-            name=dialog.name,
-            username=dialog.entity.username
-            if hasattr(dialog.entity, "username")
-            else None,
-            entity_type=extract_dialog_type(dialog),
-          )
-          session.add(dialog_model)
-      session.commit()
 
-  return dialogs
+def _save_dialogs(account_id: int, dialogs) -> int:
+  with db.session_context() as session:
+    written = upsert_dialogs(session, account_id, [dialog_to_row(d) for d in dialogs])
+    session.commit()
+  return written
 
 
 async def get_folders(client):
   """Get Telegram dialog filters (folders) with their peer IDs"""
-  filters_resp = await client(functions.messages.GetDialogFiltersRequest())
   results = []
-  for f in filters_resp.filters:
+  for f in await cache.get_dialog_filters(client):
     chat_ids = set()
     for attr in ["include_peers", "pinned_peers"]:
       if hasattr(f, attr):
@@ -206,22 +238,19 @@ def get_peer_id(peer: types.TypeInputPeer | types.TypePeer) -> int:
 async def update_folder_chats(
   client, folder_id: int, chat_ids: list[int], remove: bool = False
 ):
-  filters_resp = await client(functions.messages.GetDialogFiltersRequest())
-  target_filter = next(
-    (f for f in filters_resp.filters if getattr(f, "id", None) == folder_id), None
-  )
-
-  if not target_filter or not isinstance(target_filter, types.DialogFilter):
-    raise ValueError(f"Folder with ID {folder_id} not found.")
+  target_filter = await _get_editable_filter(client, folder_id)
 
   current_peers = list(target_filter.include_peers)
   current_pinned = list(getattr(target_filter, "pinned_peers", []))
   changed = False
 
-  # Pre-fetch entities to populate cache for ADDING
+  # Pre-fetch entities the session cannot resolve yet, for ADDING
   if not remove and chat_ids:
+    missing = [chat_id for chat_id in chat_ids if not _is_cached_peer(client, chat_id)]
     try:
-      await client.get_entity(chat_ids)
+      if missing:
+        await client.get_entity(missing)
+        await flush_entities(client)
     except Exception:
       pass
 
@@ -282,12 +311,18 @@ async def update_folder_chats(
   if changed:
     target_filter.include_peers = current_peers
     target_filter.pinned_peers = current_pinned
-    await client(
-      functions.messages.UpdateDialogFilterRequest(id=folder_id, filter=target_filter)
-    )
+    await _update_dialog_filter(client, folder_id, target_filter)
   return True
 
 
+def _is_cached_peer(client, chat_id: int) -> bool:
+  try:
+    client.session.get_input_entity(chat_id)
+    return True
+  except ValueError:
+    return False
+
+
 async def update_folder_chat(
   client, folder_id: int, chat_id: int, remove: bool = False
 ):
@@ -300,8 +335,8 @@ async def create_folder(client, title: str, chat_id: int | None = None):
     chat_id = me.id
 
   input_peer = await client.get_input_entity(chat_id)
-  filters_resp = await client(functions.messages.GetDialogFiltersRequest())
-  existing_ids = [f.id for f in filters_resp.filters if hasattr(f, "id")]
+  filters = await cache.get_dialog_filters(client)
+  existing_ids = [f.id for f in filters if hasattr(f, "id")]
   new_id = max(existing_ids) + 1 if existing_ids else 2
 
   new_filter = types.DialogFilter(
@@ -312,39 +347,82 @@ async def create_folder(client, title: str, chat_id: int | None = None):
     exclude_peers=[],
   )
 
-  await client(
-    functions.messages.UpdateDialogFilterRequest(id=new_id, filter=new_filter)
-  )
+  await _update_dialog_filter(client, new_id, new_filter)
   return new_id
 
 
 async def delete_folder(client, folder_id: int):
-  await client(functions.messages.UpdateDialogFilterRequest(id=folder_id, filter=None))
+  await _update_dialog_filter(client, folder_id, None)
   return True
 
 
 async def rename_folder(client, folder_id: int, new_title: str):
-  filters_resp = await client(functions.messages.GetDialogFiltersRequest())
+  target_filter = await _get_editable_filter(client, folder_id)
+  target_filter.title = types.TextWithEntities(text=new_title, entities=[])
+  await _update_dialog_filter(client, folder_id, target_filter)
+  return True
+
+
+async def _get_editable_filter(client, folder_id: int) -> types.DialogFilter:
+  """Copy of a folder's filter, so edits never leak into the cached one."""
+  filters = await cache.get_dialog_filters(client)
   target_filter = next(
-    (f for f in filters_resp.filters if getattr(f, "id", None) == folder_id), None
+    (f for f in filters if getattr(f, "id", None) == folder_id), None
   )
 
   if not target_filter or not isinstance(target_filter, types.DialogFilter):
     raise ValueError(f"Folder with ID {folder_id} not found.")
-
-  target_filter.title = types.TextWithEntities(text=new_title, entities=[])
-  await client(
-    functions.messages.UpdateDialogFilterRequest(id=folder_id, filter=target_filter)
-  )
-  return True
+  return copy.deepcopy(target_filter)
 
 
-async def resolve_username(client, user_id: int) -> str | None:
-  """Resolve a Telegram user ID to a username if available."""
+async def _update_dialog_filter(client, folder_id: int, dialog_filter) -> None:
   try:
-    entity = await client.get_entity(user_id)
-    if hasattr(entity, "username") and entity.username:
-      return entity.username
-  except Exception:
-    pass
-  return None
+    await client(
+      functions.messages.UpdateDialogFilterRequest(id=folder_id, filter=dialog_filter)
+    )
+  finally:
+    cache.invalidate_dialog_filters(client)
+
+
+async def resolve_usernames(client, user_ids: Iterable[int]) -> dict[int, str | None]:
+  """Resolve many Telegram user IDs to usernames at once.
+
+  IDs confirmed within USERNAME_TTL are served from the PeerEntity cache,
+  the rest are requested in chunked users.GetUsers calls. Users without a
+  username, or unknown to the session, map to None.
+  """
+  pending = set(user_ids)
+  result: dict[int, str | None] = {}
+  account_id = getattr(client, "account_id", None)
+
+  if account_id and pending:
+    since = datetime.now(timezone.utc) - USERNAME_TTL
+    with db.session_context() as session:
+      for entity in get_fresh_peer_entities(session, account_id, pending, since):
+        result[entity.peer_id] = entity.username
+    pending -= result.keys()
+
+  input_users = []
+  for user_id in pending:
+    result[user_id] = None
+    try:
+      input_users.append(utils.get_input_user(client.session.get_input_entity(user_id)))
+    except (ValueError, TypeError):
+      # No access hash known, Telegram would reject the whole chunk
+      continue
+
+  for start in range(0, len(input_users), GET_USERS_CHUNK_SIZE):
+    chunk = input_users[start : start + GET_USERS_CHUNK_SIZE]
+    try:
+      users = await client(functions.users.GetUsersRequest(id=chunk))
+    except Exception as e:
+      print(f"Failed to resolve {len(chunk)} users: {e}")
+      continue
+    users = [u for u in users if isinstance(u, types.User)]
+    for user in users:
+      result[user.id] = user.username
+    if isinstance(client.session, DbSession):
+      client.session.mark_fresh(users)
+
+  await flush_entities(client)
+  return result
@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timezone
+from telethon import utils
+from telethon.sessions import StringSession
+from telethon.tl.types import PeerChannel, PeerChat, PeerUser
+from shared import models as db
+from .db_ops import load_peer_entities, upsert_peer_entities
+
+_PEER_TYPES = {
+  PeerUser: db.PeerType.USER,
+  PeerChat: db.PeerType.CHAT,
+  PeerChannel: db.PeerType.CHANNEL,
+}
+
+
+class DbSession(StringSession):
+  """StringSession with an entity cache backed by the `PeerEntity` table.
+
+  The first lookup that misses memory loads every cached peer of the
+  account in one query, so entity resolution after a restart needs no
+  network round trips. Entities Telethon sees in responses are collected
+  and written back by `flush_entities`.
+  """
+
+  def __init__(self, string: str | None = None, account_id: int | None = None):
+    super().__init__(string)
+    self.account_id = account_id
+    self._loaded = account_id is None
+    self._dirty: dict[int, tuple] = {}
+
+  def process_entities(self, tlo):
+    # Only entities that are new or changed need to be written back
+    rows = set(self._entities_to_rows(tlo)) - self._entities
+    if not rows:
+      return
+    self._entities |= rows
+    if self.account_id is not None:
+      for row in rows:
+        self._dirty[row[0]] = row
+
+  def get_entity_rows_by_id(self, id, exact=True):
+    result = super().get_entity_rows_by_id(id, exact)
+    if result is None and self._load():
+      result = super().get_entity_rows_by_id(id, exact)
+    return result
+
+  def get_entity_rows_by_username(self, username):
+    result = super().get_entity_rows_by_username(username)
+    if result is None and self._load():
+      result = super().get_entity_rows_by_username(username)
+    return result
+
+  def get_entity_rows_by_phone(self, phone):
+    result = super().get_entity_rows_by_phone(phone)
+    if result is None and self._load():
+      result = super().get_entity_rows_by_phone(phone)
+    return result
+
+  def mark_fresh(self, tlo) -> None:
+    """Write entities back on the next flush even if unchanged, so their
+    `updated_at` records that they were just confirmed by Telegram."""
+    rows = self._entities_to_rows(tlo)
+    self._entities |= set(rows)
+    if self.account_id is not None:
+      for row in rows:
+        self._dirty[row[0]] = row
+
+  def take_dirty_rows(self) -> list[dict]:
+    rows, self._dirty = self._dirty, {}
+    now = datetime.now(timezone.utc)
+    return [
+      {
+        "peer_id": peer_id,
+        "access_hash": access_hash,
+        "peer_type": _PEER_TYPES[utils.resolve_id(peer_id)[1]],
+        "username": username,
+        "phone": phone,
+        "name": name,
+        "updated_at": now,
+      }
+      for peer_id, access_hash, username, phone, name in rows.values()
+    ]
+
+  def _load(self) -> bool:
+    """Load cached peers from the DB once. Returns True if anything was added."""
+    if self._loaded:
+      return False
+    self._loaded = True
+    with db.session_context() as session:
+      entities = load_peer_entities(session, self.account_id)
+    rows = {(e.peer_id, e.access_hash, e.username, e.phone, e.name) for e in entities}
+    self._entities |= rows
+    return bool(rows)
+
+
+def _write_entities(account_id: int, rows: list[dict]) -> None:
+  with db.session_context() as session:
+    upsert_peer_entities(session, account_id, rows)
+    session.commit()
+
+
+async def flush_entities(client) -> None:
+  """Persist entities the client has seen since the last flush."""
+  session = client.session
+  if not isinstance(session, DbSession) or session.account_id is None:
+    return
+  rows = session.take_dirty_rows()
+  if rows:
+    await asyncio.to_thread(_write_entities, session.account_id, rows)